@@ -0,0 +1,218 @@
+# Online backups of business.db and restore from them
+#
+# Snapshots are taken with SQLite's backup API from the app's own
+# connection, a few pages per step, so sales keep going in while it runs:
+# db.lock is held during each step and let go between them, so a step never
+# copies another thread's uncommitted pages, and writes made in between are
+# copied into the snapshot as well instead of restarting it. Each snapshot is integrity
+# checked before it replaces the .part file and only the newest KEEP are
+# kept. Year archives (see Database.archive_year) rarely change, so they are
+# mirrored once into backups/archives instead of into every snapshot.
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+from database import sqlite_uri
+
+KEEP = 7
+PAGES_PER_STEP = 64  # 256 KB with the default page size
+STEP_PAUSE = 0.005  # seconds between steps, for the writers waiting on the connection
+BACKUP_EVERY = 24 * 3600  # seconds between the automatic backups
+
+
+def backup_dir(db):
+    return os.path.join(os.path.dirname(db.db_path), 'backups')
+
+
+def snapshots(directory):
+    # [(path, datetime), ...] newest first
+    found = []
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            stem, ext = os.path.splitext(name)
+            if ext != '.db':
+                continue
+            try:
+                created = datetime.strptime(stem[-15:], "%Y%m%d_%H%M%S")
+            except ValueError:
+                continue
+            found.append((os.path.join(directory, name), created))
+    return sorted(found, key=lambda item: item[1], reverse=True)
+
+
+def check_integrity(path):
+    # Raises ValueError unless PRAGMA integrity_check passes
+    conn = sqlite3.connect(sqlite_uri(path, 'ro'), uri=True)
+    try:
+        result = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    finally:
+        conn.close()
+    if result != ['ok']:
+        raise ValueError(f"Copia dañada: {'; '.join(result[:3])}")
+
+
+def backup_due(db, directory=None, every=BACKUP_EVERY):
+    found = snapshots(directory or backup_dir(db))
+    return not found or (datetime.now() - found[0][1]).total_seconds() >= every
+
+
+def backup(db, directory=None, keep=KEEP, progress=None):
+    # Writes backups/<name>_YYYYmmdd_HHMMSS.db and returns its path.
+    # progress(fraction) is called between steps; raising from it cancels.
+    directory = directory or backup_dir(db)
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(db.db_path))[0]
+    path = os.path.join(directory, f"{stem}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db")
+    part = path + '.part'
+    if os.path.exists(part):
+        os.remove(part)
+
+    def step(status, remaining, total):
+        # Between steps: the writers waiting on db.lock get their turn
+        db.lock.release()
+        try:
+            if progress is not None:
+                progress((total - remaining) / total if total else 1)
+            time.sleep(STEP_PAUSE)
+        finally:
+            db.lock.acquire()
+
+    dest = sqlite3.connect(part)
+    try:
+        db.lock.acquire()
+        try:
+            db.conn.backup(dest, pages=PAGES_PER_STEP, progress=step)
+        finally:
+            db.lock.release()
+        # A snapshot is one self-contained file, whatever the source's journal
+        dest.execute("PRAGMA journal_mode=DELETE")
+    except BaseException:
+        dest.close()
+        os.remove(part)
+        raise
+    dest.close()
+
+    try:
+        check_integrity(part)
+    except ValueError:
+        os.remove(part)
+        raise
+    os.replace(part, path)
+
+    mirror_archives(db, directory)
+    for old, created in snapshots(directory)[keep:]:
+        os.remove(old)
+    if progress is not None:
+        progress(1)
+    return path
+
+
+def copy_database(path, dest):
+    # Copies the business.db at path to dest with the backup API, so what is
+    # still in its WAL comes along, and the year archives it refers to next
+    # to dest. The original is only read. Returns the years whose archive
+    # file is missing.
+    copy_file(path, dest)
+    conn = sqlite3.connect(sqlite_uri(dest, 'ro'), uri=True)
+    try:
+        archives = []
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name='archives'").fetchone():
+            archives = conn.execute("SELECT year, file FROM archives").fetchall()
+    finally:
+        conn.close()
+    missing = []
+    for year, file in archives:
+        archive = os.path.join(os.path.dirname(path), file)
+        if os.path.exists(archive):
+            copy_file(archive, os.path.join(os.path.dirname(dest), file))
+        else:
+            missing.append(year)
+    return missing
+
+
+def copy_file(path, dest):
+    # One database file through the backup API, as a self-contained file
+    src = sqlite3.connect(sqlite_uri(path, 'ro'), uri=True)
+    copy = sqlite3.connect(dest)
+    try:
+        src.backup(copy)
+        copy.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        src.close()
+        copy.close()
+
+
+def mirror_archives(db, directory):
+    # Copies year archives that are new or changed since their last copy
+    archive_dir = os.path.join(directory, 'archives')
+    for year, path in db.archived_years().items():
+        if not os.path.exists(path):
+            continue
+        copy = os.path.join(archive_dir, os.path.basename(path))
+        stat = os.stat(path)
+        if os.path.exists(copy) and (os.path.getsize(copy), os.path.getmtime(copy)) == (stat.st_size, stat.st_mtime):
+            continue
+        os.makedirs(archive_dir, exist_ok=True)
+        copy_file(path, copy + '.part')
+        check_integrity(copy + '.part')
+        os.replace(copy + '.part', copy)
+        # Same mtime as the original marks the copy as current
+        os.utime(copy, (stat.st_atime, stat.st_mtime))
+
+
+def restore(db, path, directory=None):
+    # Replaces the database's contents with the snapshot at path. Any year
+    # archive the snapshot refers to that is missing is put back first, so
+    # the reopened database finds them all. The copy goes through the backup
+    # API into the live connection, so it is one write transaction: readers
+    # see the old or the new books, never a mix, and a failure leaves the old
+    # ones in place. The connection is then reopened so the schema and cached
+    # names come from the snapshot. Returns the years still missing.
+    check_integrity(path)
+    archive_dir = os.path.join(directory or backup_dir(db), 'archives')
+    db_dir = os.path.dirname(db.db_path)
+    source = sqlite3.connect(sqlite_uri(path, 'ro'), uri=True)
+    try:
+        archives = []
+        if source.execute("SELECT 1 FROM sqlite_master WHERE name='archives'").fetchone():
+            archives = source.execute("SELECT year, file FROM archives").fetchall()
+        missing = []
+        for year, file in archives:
+            archive = os.path.join(db_dir, file)
+            if not os.path.exists(archive):
+                copy = os.path.join(archive_dir, file)
+                if os.path.exists(copy):
+                    shutil.copyfile(copy, archive + '.part')
+                    os.replace(archive + '.part', archive)
+                else:
+                    missing.append(year)
+        with db.lock:
+            source.backup(db.conn)
+            db.reopen()
+    finally:
+        source.close()
+    return missing
+
+
+if __name__ == '__main__':
+    # python backup.py backup|list|restore [snapshot] [db_path]
+    import sys
+    from database import Database, DB_PATH
+
+    args = sys.argv[1:]
+    if not args or args[0] not in ('backup', 'list', 'restore') or (args[0] == 'restore' and len(args) < 2):
+        sys.exit("usage: python backup.py backup|list [db_path] | restore <snapshot> [db_path]")
+    rest = args[2:] if args[0] == 'restore' else args[1:]
+    db = Database(rest[0] if rest else DB_PATH)
+    try:
+        if args[0] == 'backup':
+            print(backup(db))
+        elif args[0] == 'list':
+            for path, created in snapshots(backup_dir(db)):
+                print(f"{created:%Y-%m-%d %H:%M:%S}  {path}")
+        else:
+            missing = restore(db, args[1])
+            print("Restaurado" + (f"; faltan los archivos de {missing}" if missing else ""))
+    finally:
+        db.close()
@@ -0,0 +1,160 @@
+# Month-end reports for several shops at once
+#
+#   python batch_report.py tienda1/business.db tienda2/business.db --out informes
+#
+# Each database file gets the Balance screen's reports (Diario through Anual,
+# PDF and Excel) in its own folder, generated in parallel across processes,
+# plus a consolidated report that adds all shops together. The shops' files
+# are only read: each one is copied to a temporary folder and reported from
+# there, so migrations never run on them.
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from database import Database, from_cents, to_cents
+import backup
+import reports
+
+REPORT_TYPES = ["Diario", "Semanal", "Quincenal", "Mensual", "Anual"]
+FORMATS = ["pdf", "xlsx"]
+
+
+def store_names(paths):
+    # Copies from the phones are usually all called business.db, so the
+    # folder they were copied into names the shop
+    names = []
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if stem == 'business':
+            stem = os.path.basename(os.path.dirname(os.path.abspath(path))) or stem
+        name, n = stem, 2
+        while name in names:
+            name, n = f"{stem}_{n}", n + 1
+        names.append(name)
+    return names
+
+
+def export(db, report, directory, formats, detailed):
+    exporters = {
+        'pdf': reports.export_pdf_detailed if detailed else reports.export_pdf,
+        'xlsx': reports.export_excel_detailed if detailed else reports.export_excel,
+    }
+    for extension in formats:
+        file_path = reports.export_path(report, extension, directory=directory)
+        if detailed:
+            exporters[extension](db, report, file_path)
+        else:
+            exporters[extension](report, file_path)
+
+
+def generate_store(db_path, store, out_dir, types, formats, today, detailed=False):
+    # Runs in a worker process; returns {report_type: report} for consolidation
+    directory = os.path.join(out_dir, store)
+    os.makedirs(directory, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix='batch-report-')
+    try:
+        copy = os.path.join(work_dir, os.path.basename(db_path))
+        missing = backup.copy_database(db_path, copy)
+        if missing and detailed:
+            # The summaries come from the rollups; the detail needs the rows
+            raise FileNotFoundError(f"Faltan los archivos de {missing}")
+        db = Database(copy)
+        try:
+            results = {}
+            for report_type in types:
+                start, end = reports.report_period(report_type, today=today)
+                report = reports.build_report(db, report_type, start, end)
+                export(db, report, directory, formats, detailed)
+                results[report_type] = report
+            return results
+        finally:
+            db.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def consolidate(report_type, store_reports):
+    # Adds the shops' reports of one period into a report of the same shape,
+    # in integer cents like build_report
+    sales = {}
+    for report in store_reports:
+        for method, val in report['sales']:
+            sales[method] = sales.get(method, 0) + to_cents(val)
+    first = store_reports[0]
+    total_sales = sum(sales.values())
+    total_purchases = sum(to_cents(report['total_purchases']) for report in store_reports)
+    return {
+        'type': f"{report_type} Consolidado",
+        'start': first['start'],
+        'end': first['end'],
+        'sales': [(method, from_cents(cents)) for method, cents in sales.items()],
+        'total_sales': from_cents(total_sales),
+        'total_purchases': from_cents(total_purchases),
+        'profits': from_cents(total_sales - total_purchases),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate Balance reports for many business.db files")
+    parser.add_argument('databases', nargs='+')
+    parser.add_argument('--out', default='informes')
+    parser.add_argument('--types', default=",".join(REPORT_TYPES))
+    parser.add_argument('--formats', default=",".join(FORMATS))
+    parser.add_argument('--date', help="reference day YYYY-MM-DD for the periods (default: today)")
+    parser.add_argument('--detailed', action='store_true', help="export every transaction, not just the summary")
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    types = [t for t in args.types.split(',') if t]
+    formats = [f for f in args.formats.split(',') if f]
+    for report_type in types:
+        if report_type not in REPORT_TYPES:
+            parser.error(f"unknown report type {report_type}")
+    for extension in formats:
+        if extension not in FORMATS:
+            parser.error(f"unknown format {extension}")
+    today = datetime.strptime(args.date, "%Y-%m-%d") if args.date else datetime.now()
+
+    stores = store_names(args.databases)
+    by_store = {}
+    failed = False
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(generate_store, path, store, args.out, types, formats, today, args.detailed): store
+                   for path, store in zip(args.databases, stores)}
+        for future in as_completed(futures):
+            store = futures[future]
+            try:
+                by_store[store] = future.result()
+                print(f"{store}: ok")
+            except Exception as e:
+                failed = True
+                print(f"{store}: error: {e}", file=sys.stderr)
+
+    if not by_store:
+        return 1
+
+    # Consolidated cross-store summary, exported with the same code
+    directory = os.path.join(args.out, "consolidado")
+    os.makedirs(directory, exist_ok=True)
+    for report_type in types:
+        store_reports = [by_store[store][report_type] for store in stores if store in by_store]
+        report = consolidate(report_type, store_reports)
+        for extension in formats:
+            file_path = reports.export_path(report, extension, directory=directory)
+            (reports.export_pdf if extension == 'pdf' else reports.export_excel)(report, file_path)
+
+        print(f"\n{report['type']} ({report['start']} a {report['end']})")
+        for store in stores:
+            if store in by_store:
+                r = by_store[store][report_type]
+                print(f"  {store}: Ventas {r['total_sales']}  Compras {r['total_purchases']}  Ganancias {r['profits']}")
+        print(f"  Total: Ventas {report['total_sales']}  Compras {report['total_purchases']}  "
+              f"Ganancias {report['profits']}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,181 @@
+# Headless benchmark of the operations behind the screens, printed as JSON
+#
+#   python bench.py --sales 100000 --purchases 50000 --years 3 > before.json
+#
+# Runs without Kivy or a display: it drives database.py and reports.py the
+# same way the screens do, on a synthetic business.db.
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from database import Database, PAYMENT_METHODS
+import backup
+import reports
+from salebuffer import SaleBuffer
+
+REPORT_TYPES = ["Diario", "Semanal", "Quincenal", "Mensual", "Anual"]
+PLACES = [f"Lugar {i}" for i in range(40)]
+PRODUCTS = [f"Producto {i}" for i in range(400)]
+
+
+def seed(db, sales, purchases, years, rng, batch_size=10000):
+    # Spreads rows uniformly over the last `years` years up to today
+    today = date.today()
+    days = max(int(years * 365), 1)
+
+    def random_date():
+        return (today - timedelta(days=rng.randrange(days))).isoformat()
+
+    for start in range(0, sales, batch_size):
+        db.add_sales_bulk([(random_date(), rng.randint(1, 500) * 100.0, rng.choice(PAYMENT_METHODS))
+                           for _ in range(min(batch_size, sales - start))])
+    for start in range(0, purchases, batch_size):
+        db.add_purchases_bulk([(random_date(), rng.choice(PLACES), rng.choice(PRODUCTS),
+                                rng.randint(1, 20) / 2, rng.randint(1, 2000) * 50.0)
+                               for _ in range(min(batch_size, purchases - start))])
+    with db.lock:
+        db.conn.execute("ANALYZE")
+
+
+def measure(fn, repeat):
+    # Milliseconds per call; the first call also warms the page cache
+    times = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - started) * 1000)
+    return {
+        'min_ms': round(min(times), 3),
+        'median_ms': round(statistics.median(times), 3),
+        'mean_ms': round(statistics.mean(times), 3),
+        'runs': repeat,
+    }, result
+
+
+def operations(db, out_dir, rng):
+    # (name, callable, runs) for every operation a screen triggers
+    today = date.today().isoformat()
+    ops = [
+        ('add_sale', lambda: db.add_sale(today, rng.randint(1, 500) * 100.0, rng.choice(PAYMENT_METHODS)), None),
+        ('add_purchase', lambda: db.add_purchase(today, rng.choice(PLACES), rng.choice(PRODUCTS), 1.0, 500.0), None),
+        ('load_daily_sales', lambda: db.daily_sales(today), None),
+        ('load_daily_purchases', lambda: db.daily_purchases(today), None),
+    ]
+    for report_type in REPORT_TYPES:
+        start, end = reports.report_period(report_type)
+        ops.append((f'generate_report_{report_type}',
+                    lambda report_type=report_type, start=start, end=end: reports.build_report(db, report_type, start, end),
+                    None))
+
+    cache = reports.ReportCache(db)
+    start, end = reports.report_period("Anual")
+    ops.append(('generate_report_Anual_cached', lambda: cache.get("Anual", start, end), None))
+
+    # Exports run on the yearly report, the largest the app offers. Detailed
+    # exports of a big year take seconds each, so one run is enough.
+    report = reports.build_report(db, "Anual", start, end)
+    ops += [
+        ('export_pdf', lambda: reports.export_pdf(report, os.path.join(out_dir, "r.pdf")), None),
+        ('export_excel', lambda: reports.export_excel(report, os.path.join(out_dir, "r.xlsx")), None),
+        ('export_pdf_detailed', lambda: reports.export_pdf_detailed(db, report, os.path.join(out_dir, "d.pdf")), 1),
+        ('export_excel_detailed', lambda: reports.export_excel_detailed(db, report, os.path.join(out_dir, "d.xlsx")), 1),
+    ]
+    return ops
+
+
+def sale_throughput(db, count, rng):
+    # Sales per second entered back to back, one commit each versus through
+    # the group-commit buffer (timed until the last one is committed)
+    today = date.today().isoformat()
+    sales = [(today, rng.randint(1, 500) * 100.0, rng.choice(PAYMENT_METHODS)) for _ in range(count)]
+    results = {}
+
+    started = time.perf_counter()
+    for sale in sales:
+        db.add_sale(*sale)
+    results['add_sale'] = count / (time.perf_counter() - started)
+
+    buffer = SaleBuffer(db)
+    started = time.perf_counter()
+    for sale in sales:
+        buffer.add(*sale)
+    buffer.close()
+    results['buffered'] = count / (time.perf_counter() - started)
+    return {name: round(rate, 1) for name, rate in results.items()}
+
+
+def run(db, repeat, out_dir, rng, skip=()):
+    results = {}
+    for name, fn, runs in operations(db, out_dir, rng):
+        if name in skip:
+            continue
+        results[name], result = measure(fn, runs or repeat)
+        if isinstance(result, list):
+            results[name]['rows'] = len(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark business.db operations without a display")
+    parser.add_argument('--sales', type=int, default=10000)
+    parser.add_argument('--purchases', type=int, default=5000)
+    parser.add_argument('--years', type=float, default=2)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--db', help="benchmark a copy of this database instead of seeding one")
+    parser.add_argument('--sales-per-second', type=int, default=2000, metavar='N',
+                        help="sales entered to measure insert throughput (0 to skip)")
+    parser.add_argument('--skip', default="", help="comma-separated operations to skip, e.g. export_pdf_detailed")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    work_dir = tempfile.mkdtemp(prefix='bench-')
+    try:
+        db_path = os.path.join(work_dir, 'business.db')
+        if args.db:
+            # The benchmark inserts rows, so it never touches the original
+            # files; the copy takes along its WAL and year archives
+            backup.copy_database(args.db, db_path)
+        started = time.perf_counter()
+        db = Database(db_path)
+        init_ms = (time.perf_counter() - started) * 1000
+        seed_ms = None
+        if not args.db:
+            started = time.perf_counter()
+            seed(db, args.sales, args.purchases, args.years, rng)
+            seed_ms = (time.perf_counter() - started) * 1000
+
+        results = run(db, args.repeat, work_dir, rng, set(filter(None, args.skip.split(','))))
+        # Until a checkpoint the new rows live in the -wal file, not the database's
+        with db.lock:
+            db.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        output = {
+            'dataset': {
+                'sales': db.count_sales('1970-01-01', '9999-12-31'),
+                'purchases': db.count_purchases('1970-01-01', '9999-12-31'),
+                'years': args.years,
+                'db_bytes': os.path.getsize(db_path),
+            },
+            'db_init_ms': round(init_ms, 3),
+            'seed_ms': seed_ms and round(seed_ms, 3),
+            'results': results,
+        }
+        if args.sales_per_second:
+            output['sales_per_second'] = sale_throughput(db, args.sales_per_second, rng)
+        db.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    json.dump(output, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+# End-to-end checks of the paths that touch a shop's data on disk
+#
+#   python checks.py
+#
+# Each check builds its files in a temporary folder and raises
+# AssertionError on the first difference. Covered: upgrading a business.db
+# in the original app's format, replaying the sale journal after the app is
+# killed, archiving a closed year (also when killed halfway) and rebuilding
+# the rollups from it, backing up while sales come in and restoring, and
+# batch reports over shop folders whose names need quoting in a file: URI.
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import traceback
+from datetime import date, datetime
+from database import Database, MIGRATIONS, SALE, to_day
+import backup
+import batch_report
+import reports
+from salebuffer import SaleBuffer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def check_migrate_baseline(directory):
+    # The schema and rows the first release wrote, with no user_version
+    path = os.path.join(directory, 'business.db')
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE users (username TEXT PRIMARY KEY, password TEXT);
+        CREATE TABLE sales (id INTEGER PRIMARY KEY, date TEXT, value REAL, payment_method TEXT);
+        CREATE TABLE purchases (id INTEGER PRIMARY KEY, date TEXT, place TEXT, product TEXT,
+                                quantity REAL, value REAL);
+        CREATE TABLE places (name TEXT UNIQUE);
+        CREATE TABLE products (name TEXT UNIQUE);
+        INSERT INTO users VALUES ('ana', '1234');
+        INSERT INTO sales (date, value, payment_method) VALUES
+            ('2025-03-01', 12.35, 'Efectivo'), ('2025-03-01', 12.3, 'Nequi'),
+            ('2025-03-02', 12.3, 'Transferencia'), ('2025-03-02', 0.1, 'Efectivo');
+        INSERT INTO places VALUES ('Plaza');
+        INSERT INTO products VALUES ('Papa');
+        INSERT INTO purchases (date, place, product, quantity, value) VALUES
+            ('2025-03-01', 'Plaza', 'Papa', 2.5, 7.2), ('2025-03-02', 'Plaza', 'Papa', 1, 0.2);
+    ''')
+    conn.commit()
+    conn.close()
+
+    db = Database(path)
+    try:
+        assert db.conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+        assert db.check_user('ana', '1234')
+        assert db.daily_sales('2025-03-01') == [('Efectivo', 12.35), ('Nequi', 12.3)], db.daily_sales('2025-03-01')
+        assert db.sales_by_method('2025-03-01', '2025-03-31', cents=True) == \
+            [('Efectivo', 1245), ('Nequi', 1230), ('Transferencia', 1230)]
+        assert db.total_purchases('2025-03-01', '2025-03-31', cents=True) == 740
+        assert db.daily_purchases('2025-03-01') == [('Plaza', 'Papa', 2.5, 7.2)]
+        assert db.place_usage() == [('Plaza', 2, db.conn.execute("SELECT MAX(day) FROM purchases").fetchone()[0])]
+        # Migrating again is a no-op
+        db.reopen()
+        assert db.count_sales('2025-01-01', '2025-12-31') == 4
+    finally:
+        db.close()
+
+
+def check_replay_after_kill(directory):
+    path = os.path.join(directory, 'business.db')
+    Database(path).close()
+    # A child process dies without any cleanup, leaving in its journal:
+    # entries committed in a batch the journal was not yet cleared of, then
+    # entries never committed, then a line torn by the kill
+    child = f'''
+import os
+from database import Database
+from salebuffer import SaleBuffer
+db = Database({path!r})
+buffer = SaleBuffer(db, flush_interval=3600, max_pending=10 ** 9)
+for i in range(5):
+    buffer.add('2026-05-01', 1000 + i, 'Efectivo')
+buffer.flush()
+for i in range(5, 8):
+    buffer.add('2026-05-01', 1000 + i, 'Nequi')
+db.add_sales_journaled([('2026-05-01', 1000 + i, 'Nequi') for i in range(5, 8)], buffer.seq)
+for i in range(8, 10):
+    buffer.add('2026-05-01', 1000 + i, 'Transferencia')
+buffer.journal.write('[11, "2026-05-01", 1')
+buffer.journal.flush()
+os._exit(1)
+'''
+    subprocess.run([sys.executable, '-c', child], cwd=HERE, check=False)
+
+    db = Database(path)
+    try:
+        buffer = SaleBuffer(db)
+        buffer.close()
+        values = sorted(value for method, value in db.daily_sales('2026-05-01'))
+        assert values == [1000 + i for i in range(10)], values
+        assert db.journal_seq() == 10
+        # A second start finds nothing left to replay
+        SaleBuffer(db).close()
+        assert db.count_sales('2026-05-01', '2026-05-01') == 10
+    finally:
+        db.close()
+
+
+def check_archive_rebuild(directory):
+    path = os.path.join(directory, 'business.db')
+    db = Database(path)
+    try:
+        db.add_sales_bulk([('2024-02-01', 10.1, 'Efectivo'), ('2024-12-31', 0.2, 'Nequi'),
+                           ('2026-01-01', 5, 'Efectivo')])
+        db.add_purchases_bulk([('2024-02-01', 'Plaza', 'Papa', 2, 3.3), ('2026-01-02', 'Tienda', 'Papa', 1, 1.1)])
+
+        def state():
+            return (db.sales_by_method('2024-01-01', '2026-12-31', cents=True),
+                    db.total_purchases('2024-01-01', '2026-12-31', cents=True),
+                    db.top_spend('2024-01-01', '2026-12-31', 'place'),
+                    sorted(db.place_usage()))
+        before = state()
+
+        done = db.maintain(date(2026, 6, 1))
+        assert done['archived'] == {2024: 3}, done
+        assert os.path.exists(db.archive_path(2024))
+        assert db.conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0] == 1
+        assert state() == before
+        assert [row[1] for row in db.iter_sales('2024-01-01', '2026-12-31')] == \
+            ['2024-02-01', '2024-12-31', '2026-01-01']
+
+        db.rebuild_daily_totals()
+        assert state() == before
+
+        # A missing archive stops the rebuild before it changes anything,
+        # and is not created empty
+        os.rename(db.archive_path(2024), path + '.moved')
+        try:
+            db.rebuild_daily_totals()
+        except FileNotFoundError:
+            pass
+        else:
+            raise AssertionError("rebuild without the archive succeeded")
+        assert not os.path.exists(db.archive_path(2024))
+        assert state() == before
+    finally:
+        db.close()
+
+
+def check_archive_resume(directory):
+    # A process killed halfway through deleting the archived rows; the next
+    # run finishes the move without copying anything twice
+    path = os.path.join(directory, 'business.db')
+    db = Database(path)
+    db.add_sales_bulk([(f"2024-{month:02d}-10", month, 'Efectivo') for month in range(1, 13)])
+    db.add_purchases_bulk([(f"2024-{month:02d}-11", 'Plaza', 'Papa', 1, month) for month in range(1, 13)])
+    db.close()
+    child = f'''
+import os
+import database
+chunks = []
+def sleep(seconds):
+    chunks.append(seconds)
+    if len(chunks) == 20:
+        os._exit(1)
+database.time.sleep = sleep
+database.Database({path!r}).archive_year(2024)
+'''
+    subprocess.run([sys.executable, '-c', child], cwd=HERE, check=False)
+
+    db = Database(path)
+    try:
+        left = db.conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0]
+        assert 0 < left < 12, left
+        # Added to the closed year after the kill; the resumed run leaves it
+        # for the next one
+        db.add_sale('2024-06-15', 100, 'Nequi')
+        db.archive_year(2024)
+        assert db.conn.execute("SELECT task FROM maintenance WHERE task LIKE 'archive%'").fetchall() == []
+        assert db.conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0] == 1
+        db.archive_year(2024)
+        assert db.conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0] == 0
+        assert len(list(db.iter_sales('2024-01-01', '2024-12-31'))) == 13
+        assert len(list(db.iter_purchases('2024-01-01', '2024-12-31'))) == 12
+        assert db.sales_by_method('2024-01-01', '2024-12-31', cents=True) == [('Efectivo', 7800), ('Nequi', 10000)]
+        db.rebuild_daily_totals()
+        assert db.sales_by_method('2024-01-01', '2024-12-31', cents=True) == [('Efectivo', 7800), ('Nequi', 10000)]
+        assert db.total_purchases('2024-01-01', '2024-12-31', cents=True) == 7800
+    finally:
+        db.close()
+
+
+def check_backup_restore(directory):
+    path = os.path.join(directory, 'business.db')
+    db = Database(path)
+    buffer = SaleBuffer(db)
+    try:
+        db.add_sales_bulk([(f"2025-{month:02d}-01", 10, 'Efectivo') for month in range(1, 13)])
+        db.maintain(date(2026, 6, 1))
+        for i in range(20):
+            buffer.add('2026-05-01', 1, 'Nequi')
+        buffer.flush()
+
+        # A backup taken while another thread keeps committing sales
+        stop = threading.Event()
+
+        def sell():
+            while not stop.is_set():
+                db.add_sale('2026-05-02', 1, 'Transferencia')
+        seller = threading.Thread(target=sell)
+        seller.start()
+        try:
+            snapshot = backup.backup(db, progress=lambda fraction: None)
+        finally:
+            stop.set()
+            seller.join()
+        # Each sale in the snapshot came with its rollup update (2025 is archived)
+        conn = sqlite3.connect(snapshot)
+        rows, counted = conn.execute("SELECT (SELECT COUNT(*) FROM sales), "
+                                     "(SELECT SUM(count) FROM daily_totals WHERE kind = ? AND day >= ?)",
+                                     (SALE, to_day('2026-01-01'))).fetchone()
+        conn.close()
+        assert rows == counted, (rows, counted)
+        year_2026 = ('2026-01-01', '2026-12-31')
+
+        # Restoring the older snapshot: the totals go back, cached reports
+        # are dropped and the buffer keeps numbering after its own entries
+        for i in range(5):
+            buffer.add('2026-05-03', 1, 'Nequi')
+        buffer.flush()
+        cache = reports.ReportCache(db)
+        newer = cache.get("Anual", *year_2026)
+        backup.restore(db, snapshot)
+        buffer.resync()
+        assert db.count_sales(*year_2026) == rows
+        restored = cache.get("Anual", *year_2026)
+        assert restored['total_sales'] == reports.build_report(db, "Anual", *year_2026)['total_sales']
+        assert restored['total_sales'] < newer['total_sales']
+        assert buffer.seq == 25 and db.journal_seq() == 20
+        buffer.add('2026-05-04', 1, 'Nequi')
+        buffer.flush()
+        assert db.journal_seq() == 26
+
+        # A snapshot restored into a fresh install takes the buffer past the
+        # snapshot's journal, and puts back the deleted year archive
+        buffer.close()
+        db.close()
+        os.remove(path)
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        os.remove(os.path.join(directory, 'business-2025.db'))
+        db = Database(path)
+        buffer = SaleBuffer(db)
+        assert buffer.seq == 0
+        missing = backup.restore(db, snapshot)
+        buffer.resync()
+        assert missing == [] and os.path.exists(os.path.join(directory, 'business-2025.db'))
+        assert buffer.seq == 20
+        assert len(list(db.iter_sales('2025-01-01', '2025-12-31'))) == 12
+        assert db.sales_by_method('2025-01-01', '2025-12-31', cents=True) == [('Efectivo', 12000)]
+        db.rebuild_daily_totals()
+        assert db.sales_by_method('2025-01-01', '2025-12-31', cents=True) == [('Efectivo', 12000)]
+    finally:
+        buffer.close()
+        db.close()
+
+
+def check_batch_report_paths(directory):
+    # '#', '?' and '%' in a folder name must not cut the path short
+    paths = []
+    for shop, value in (('tienda #1', 10), ('tienda 2?x=50%', 2.5)):
+        os.makedirs(os.path.join(directory, shop))
+        paths.append(os.path.join(directory, shop, 'business.db'))
+        db = Database(paths[-1])
+        db.add_sales_bulk([('2025-05-01', value, 'Efectivo'), ('2026-05-01', value, 'Nequi')])
+        db.maintain(date(2026, 6, 1))
+        db.close()
+    before = sorted(os.listdir(directory))
+
+    out = os.path.join(directory, 'informes')
+    reports_by_store = [batch_report.generate_store(path, store, out, ["Anual"], [], datetime(2026, 5, 31),
+                                                    detailed=False)
+                        for path, store in zip(paths, batch_report.store_names(paths))]
+    totals = [report["Anual"]['total_sales'] for report in reports_by_store]
+    assert totals == [10.0, 2.5], totals
+    assert batch_report.consolidate("Anual", [report["Anual"] for report in reports_by_store])['total_sales'] == 12.5
+    # Nothing was created next to the shop folders
+    assert sorted(os.listdir(directory)) == sorted(before + ['informes']), os.listdir(directory)
+
+
+CHECKS = [check_migrate_baseline, check_replay_after_kill, check_archive_rebuild, check_archive_resume,
+          check_backup_restore, check_batch_report_paths]
+
+
+def main():
+    failed = 0
+    for check in CHECKS:
+        with tempfile.TemporaryDirectory(prefix='checks-') as directory:
+            try:
+                check(directory)
+                print(f"ok    {check.__name__}")
+            except Exception:
+                failed += 1
+                print(f"FAIL  {check.__name__}")
+                traceback.print_exc()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
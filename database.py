@@ -0,0 +1,1002 @@
+# Data access layer shared by every screen
+import sqlite3
+import functools
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date as Date, datetime
+from urllib.request import pathname2url
+
+DB_PATH = os.path.join('/sdcard', 'business.db')  # Ruta para Android
+
+log = logging.getLogger(__name__)
+
+PAYMENT_METHODS = ["Efectivo", "Nequi", "Transferencia", "Deuda"]
+
+# Storage format: dates are stored as days since 1970-01-01 and money as
+# integer cents. These convert at the edge of the repository, so callers keep
+# passing 'YYYY-MM-DD' strings and getting float amounts back.
+EPOCH_ORDINAL = Date(1970, 1, 1).toordinal()
+SALE, PURCHASE = 0, 1  # daily_totals.kind
+MAX_AMOUNT = 1e15  # its cents still fit a 64-bit INTEGER
+
+
+TREND_BUCKETS = {
+    'day': "t.day",
+    'week': "(t.day + 3) / 7",
+    'month': "CAST(strftime('%Y', t.day * 86400, 'unixepoch') AS INTEGER) * 12"
+             " + CAST(strftime('%m', t.day * 86400, 'unixepoch') AS INTEGER) - 1",
+}
+
+
+def instrumented(count=None):
+    # Times the method through db.metrics when one is attached (see
+    # instrumentation.py); count(result) gives the rows it returned or wrote
+    def decorate(method):
+        name = f"db.{method.__name__}"
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.metrics is None:
+                return method(self, *args, **kwargs)
+            return self.metrics.call(name, method, self, *args, count=count, **kwargs)
+        return wrapper
+    return decorate
+
+
+def sqlite_uri(path, mode=None):
+    # file: URI for a database path. Quoted, so a '#', '?' or '%' in a folder
+    # name stays part of the path instead of starting the query string.
+    uri = "file:" + pathname2url(os.path.abspath(path))
+    return f"{uri}?mode={mode}" if mode else uri
+
+
+def to_day(date):
+    return Date.fromisoformat(date).toordinal() - EPOCH_ORDINAL
+
+
+def from_day(day):
+    return Date.fromordinal(day + EPOCH_ORDINAL).isoformat()
+
+
+def to_cents(value):
+    return int(round(value * 100))
+
+
+def from_cents(cents):
+    return (cents or 0) / 100
+
+
+# Validation shared by the screens and the bulk importer. Each raises
+# ValueError with the message the screens show in their error popup.
+def validate_date(date):
+    # Returned zero-padded: strptime takes '2026-1-5', fromisoformat does not
+    try:
+        return datetime.strptime(date, "%Y-%m-%d").date().isoformat()
+    except (TypeError, ValueError):
+        raise ValueError("Formato de fecha inválido")
+
+
+def validate_sale(value, method):
+    if not value or not method:
+        raise ValueError("Campos requeridos")
+    if method not in PAYMENT_METHODS:
+        raise ValueError("Modo de pago inválido")
+    try:
+        value = float(value)
+    except ValueError:
+        raise ValueError("Valor inválido")
+    # nan/inf parse as floats but have no cents
+    if not math.isfinite(value) or abs(value) >= MAX_AMOUNT:
+        raise ValueError("Valor inválido")
+    return value, method
+
+
+def validate_purchase(place, product, qty, value):
+    if not all([place, product, qty, value]):
+        raise ValueError("Campos requeridos")
+    try:
+        qty = float(qty)
+        value = float(value)
+    except ValueError:
+        raise ValueError("Valores inválidos")
+    if not (math.isfinite(qty) and math.isfinite(value)) or abs(value) >= MAX_AMOUNT:
+        raise ValueError("Valores inválidos")
+    return place, product, qty, value
+
+
+# Schema migrations. Each one runs in its own transaction and PRAGMA
+# user_version records how many have been applied, so a database created by
+# an older release only runs the steps it is missing.
+def migrate_base_tables(c):
+    # Users table
+    c.execute('''CREATE TABLE IF NOT EXISTS users
+                 (username TEXT PRIMARY KEY, password TEXT)''')
+
+    # Sales table
+    c.execute('''CREATE TABLE IF NOT EXISTS sales
+                 (id INTEGER PRIMARY KEY, date TEXT, value REAL, payment_method TEXT)''')
+
+    # Purchases table
+    c.execute('''CREATE TABLE IF NOT EXISTS purchases
+                 (id INTEGER PRIMARY KEY, date TEXT, place TEXT, product TEXT, quantity REAL, value REAL)''')
+
+    # Places history
+    c.execute('''CREATE TABLE IF NOT EXISTS places
+                 (name TEXT UNIQUE)''')
+
+    # Products history
+    c.execute('''CREATE TABLE IF NOT EXISTS products
+                 (name TEXT UNIQUE)''')
+
+
+def migrate_date_indexes(c):
+    # Covering indexes for the daily lists and the Balance range sums
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sales_date ON sales (date, payment_method, value)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_purchases_date ON purchases (date, value)")
+    c.execute("ANALYZE")
+
+
+def migrate_daily_totals(c):
+    # Per-day rollup the Balance reports read instead of the raw rows. Sales
+    # are kept per payment method; purchases use an empty payment_method.
+    c.execute('''CREATE TABLE IF NOT EXISTS daily_totals
+                 (date TEXT, kind TEXT, payment_method TEXT, total REAL, count INTEGER,
+                  PRIMARY KEY (date, kind, payment_method)) WITHOUT ROWID''')
+
+    # Triggers keep the rollup current for every insert path, not just the screens
+    c.execute('''CREATE TRIGGER IF NOT EXISTS sales_rollup_insert AFTER INSERT ON sales BEGIN
+                     INSERT OR IGNORE INTO daily_totals VALUES (NEW.date, 'sale', NEW.payment_method, 0, 0);
+                     UPDATE daily_totals SET total = total + NEW.value, count = count + 1
+                      WHERE date = NEW.date AND kind = 'sale' AND payment_method = NEW.payment_method;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS sales_rollup_delete AFTER DELETE ON sales BEGIN
+                     UPDATE daily_totals SET total = total - OLD.value, count = count - 1
+                      WHERE date = OLD.date AND kind = 'sale' AND payment_method = OLD.payment_method;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS purchases_rollup_insert AFTER INSERT ON purchases BEGIN
+                     INSERT OR IGNORE INTO daily_totals VALUES (NEW.date, 'purchase', '', 0, 0);
+                     UPDATE daily_totals SET total = total + NEW.value, count = count + 1
+                      WHERE date = NEW.date AND kind = 'purchase' AND payment_method = '';
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS purchases_rollup_delete AFTER DELETE ON purchases BEGIN
+                     UPDATE daily_totals SET total = total - OLD.value, count = count - 1
+                      WHERE date = OLD.date AND kind = 'purchase' AND payment_method = '';
+                 END''')
+
+    c.execute('''INSERT INTO daily_totals (date, kind, payment_method, total, count)
+                 SELECT date, 'sale', payment_method, SUM(value), COUNT(*) FROM sales
+                 GROUP BY date, payment_method''')
+    c.execute('''INSERT INTO daily_totals (date, kind, payment_method, total, count)
+                 SELECT date, 'purchase', '', SUM(value), COUNT(*) FROM purchases
+                 GROUP BY date''')
+
+
+def migrate_compact_storage(c):
+    # Integer day numbers, integer cents and small-integer keys into
+    # payment_methods/places/products instead of repeated strings
+    c.execute('''CREATE TABLE payment_methods
+                 (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)''')
+    c.executemany("INSERT INTO payment_methods (name) VALUES (?)", [(m,) for m in PAYMENT_METHODS])
+    c.execute('''INSERT OR IGNORE INTO payment_methods (name)
+                 SELECT DISTINCT payment_method FROM sales WHERE payment_method IS NOT NULL''')
+
+    for table, column in (('places', 'place'), ('products', 'product')):
+        c.execute(f'''CREATE TABLE {table}_new
+                      (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)''')
+        c.execute(f"INSERT OR IGNORE INTO {table}_new (name) SELECT name FROM {table} WHERE name IS NOT NULL")
+        c.execute(f'''INSERT OR IGNORE INTO {table}_new (name)
+                      SELECT DISTINCT {column} FROM purchases WHERE {column} IS NOT NULL''')
+        c.execute(f"DROP TABLE {table}")
+        c.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+    # julianday('YYYY-MM-DD') is always n.5, so the subtraction is exact
+    c.execute('''CREATE TABLE sales_new
+                 (id INTEGER PRIMARY KEY, day INTEGER NOT NULL, value_cents INTEGER NOT NULL,
+                  method_id INTEGER NOT NULL REFERENCES payment_methods (id))''')
+    c.execute('''INSERT INTO sales_new (id, day, value_cents, method_id)
+                 SELECT s.id, CAST(julianday(s.date) - 2440587.5 AS INTEGER), CAST(ROUND(s.value * 100) AS INTEGER), m.id
+                 FROM sales s JOIN payment_methods m ON m.name = s.payment_method
+                 WHERE julianday(s.date) IS NOT NULL AND s.value IS NOT NULL''')
+    c.execute('''CREATE TABLE purchases_new
+                 (id INTEGER PRIMARY KEY, day INTEGER NOT NULL,
+                  place_id INTEGER NOT NULL REFERENCES places (id),
+                  product_id INTEGER NOT NULL REFERENCES products (id),
+                  quantity REAL, value_cents INTEGER NOT NULL)''')
+    c.execute('''INSERT INTO purchases_new (id, day, place_id, product_id, quantity, value_cents)
+                 SELECT p.id, CAST(julianday(p.date) - 2440587.5 AS INTEGER), pl.id, pr.id, p.quantity,
+                        CAST(ROUND(p.value * 100) AS INTEGER)
+                 FROM purchases p JOIN places pl ON pl.name = p.place JOIN products pr ON pr.name = p.product
+                 WHERE julianday(p.date) IS NOT NULL AND p.value IS NOT NULL''')
+
+    # Dropping the old tables also drops their indexes and rollup triggers
+    c.execute("DROP TABLE sales")
+    c.execute("DROP TABLE purchases")
+    c.execute("DROP TABLE daily_totals")
+    c.execute("ALTER TABLE sales_new RENAME TO sales")
+    c.execute("ALTER TABLE purchases_new RENAME TO purchases")
+    c.execute("CREATE INDEX idx_sales_day ON sales (day, method_id, value_cents)")
+    c.execute("CREATE INDEX idx_purchases_day ON purchases (day, value_cents)")
+
+    # Rollup keyed the same way; purchases use method_id 0
+    c.execute('''CREATE TABLE daily_totals
+                 (day INTEGER, kind INTEGER, method_id INTEGER, total INTEGER, count INTEGER,
+                  PRIMARY KEY (day, kind, method_id)) WITHOUT ROWID''')
+    c.execute(f'''CREATE TRIGGER sales_rollup_insert AFTER INSERT ON sales BEGIN
+                      INSERT OR IGNORE INTO daily_totals VALUES (NEW.day, {SALE}, NEW.method_id, 0, 0);
+                      UPDATE daily_totals SET total = total + NEW.value_cents, count = count + 1
+                       WHERE day = NEW.day AND kind = {SALE} AND method_id = NEW.method_id;
+                  END''')
+    c.execute(f'''CREATE TRIGGER sales_rollup_delete AFTER DELETE ON sales BEGIN
+                      UPDATE daily_totals SET total = total - OLD.value_cents, count = count - 1
+                       WHERE day = OLD.day AND kind = {SALE} AND method_id = OLD.method_id;
+                  END''')
+    c.execute(f'''CREATE TRIGGER purchases_rollup_insert AFTER INSERT ON purchases BEGIN
+                      INSERT OR IGNORE INTO daily_totals VALUES (NEW.day, {PURCHASE}, 0, 0, 0);
+                      UPDATE daily_totals SET total = total + NEW.value_cents, count = count + 1
+                       WHERE day = NEW.day AND kind = {PURCHASE} AND method_id = 0;
+                  END''')
+    c.execute(f'''CREATE TRIGGER purchases_rollup_delete AFTER DELETE ON purchases BEGIN
+                      UPDATE daily_totals SET total = total - OLD.value_cents, count = count - 1
+                       WHERE day = OLD.day AND kind = {PURCHASE} AND method_id = 0;
+                  END''')
+    rebuild_daily_totals(c)
+    c.execute("ANALYZE")
+
+
+def migrate_sale_journal(c):
+    # Sequence number of the last sale journal entry committed to sales; see
+    # salebuffer.py. Stored in the same transaction as the rows themselves.
+    c.execute("CREATE TABLE sale_journal (seq INTEGER NOT NULL)")
+    c.execute("INSERT INTO sale_journal (seq) VALUES (0)")
+
+
+def migrate_archives(c):
+    # Closed years moved out to business-<year>.db files (see
+    # Database.archive_year), and when each maintenance task last ran
+    c.execute('''CREATE TABLE archives
+                 (year INTEGER PRIMARY KEY, file TEXT NOT NULL)''')
+    c.execute('''CREATE TABLE maintenance
+                 (task TEXT PRIMARY KEY, last_day INTEGER NOT NULL)''')
+
+
+def migrate_purchase_totals(c):
+    # Per product, place and day rollup of purchases for the cost analytics.
+    # The key puts each product's rows together, for its unit cost over time
+    # and spend by product; the place index does the same for spend by place,
+    # and the day index covers short ranges. Like daily_totals it keeps the
+    # archived years, so looking back needs no ATTACH.
+    c.execute('''CREATE TABLE purchase_totals
+                 (product_id INTEGER, day INTEGER, place_id INTEGER,
+                  total INTEGER, quantity REAL, count INTEGER,
+                  PRIMARY KEY (product_id, day, place_id)) WITHOUT ROWID''')
+    c.execute("CREATE INDEX idx_purchase_totals_day ON purchase_totals (day, total, quantity, count)")
+    c.execute("CREATE INDEX idx_purchase_totals_place ON purchase_totals (place_id, day, total, quantity, count)")
+    c.execute('''CREATE TRIGGER purchase_totals_insert AFTER INSERT ON purchases BEGIN
+                     INSERT OR IGNORE INTO purchase_totals VALUES (NEW.product_id, NEW.day, NEW.place_id, 0, 0, 0);
+                     UPDATE purchase_totals SET total = total + NEW.value_cents,
+                                                quantity = quantity + COALESCE(NEW.quantity, 0), count = count + 1
+                      WHERE product_id = NEW.product_id AND day = NEW.day AND place_id = NEW.place_id;
+                 END''')
+    c.execute('''CREATE TRIGGER purchase_totals_delete AFTER DELETE ON purchases BEGIN
+                     UPDATE purchase_totals SET total = total - OLD.value_cents,
+                                                quantity = quantity - COALESCE(OLD.quantity, 0), count = count - 1
+                      WHERE product_id = OLD.product_id AND day = OLD.day AND place_id = OLD.place_id;
+                 END''')
+    # Filled here from the main tables, in the migration's transaction. The
+    # archived years cannot be attached inside it, so when there are any a
+    # full rebuild is recorded as due and init_schema runs it (again on each
+    # start until it succeeds)
+    rebuild_purchase_totals(c)
+    c.execute("INSERT INTO maintenance (task, last_day) SELECT 'rebuild_totals', 0 "
+              "WHERE EXISTS (SELECT 1 FROM archives)")
+
+
+def create_archive_tables(c, schema):
+    # Same rows and indexes as the main tables; the names they point to stay
+    # in the main database's payment_methods/places/products
+    c.execute(f'''CREATE TABLE IF NOT EXISTS {schema}.sales
+                  (id INTEGER PRIMARY KEY, day INTEGER NOT NULL, value_cents INTEGER NOT NULL,
+                   method_id INTEGER NOT NULL)''')
+    c.execute(f'''CREATE TABLE IF NOT EXISTS {schema}.purchases
+                  (id INTEGER PRIMARY KEY, day INTEGER NOT NULL, place_id INTEGER NOT NULL,
+                   product_id INTEGER NOT NULL, quantity REAL, value_cents INTEGER NOT NULL)''')
+    c.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_sales_day ON sales (day, method_id, value_cents)")
+    c.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_purchases_day ON purchases (day, value_cents)")
+
+
+def rebuild_daily_totals(c):
+    # Recomputes the rollup from the raw rows
+    c.execute("DELETE FROM daily_totals")
+    c.execute(f'''INSERT INTO daily_totals (day, kind, method_id, total, count)
+                  SELECT day, {SALE}, method_id, SUM(value_cents), COUNT(*) FROM sales
+                  GROUP BY day, method_id''')
+    c.execute(f'''INSERT INTO daily_totals (day, kind, method_id, total, count)
+                  SELECT day, {PURCHASE}, 0, SUM(value_cents), COUNT(*) FROM purchases
+                  GROUP BY day''')
+
+
+def stage_totals(c, schema):
+    # Adds the per-day sums of schema's rows (main or an attached archive) to
+    # the temp.staged_* tables; replace_totals() swaps them in
+    c.execute(f'''INSERT INTO temp.staged_totals (day, kind, method_id, total, count)
+                  SELECT day, {SALE}, method_id, SUM(value_cents), COUNT(*) FROM {schema}.sales
+                  GROUP BY day, method_id''')
+    c.execute(f'''INSERT INTO temp.staged_totals (day, kind, method_id, total, count)
+                  SELECT day, {PURCHASE}, 0, SUM(value_cents), COUNT(*) FROM {schema}.purchases
+                  GROUP BY day''')
+    c.execute(f'''INSERT INTO temp.staged_purchase_totals (product_id, day, place_id, total, quantity, count)
+                  SELECT product_id, day, place_id, SUM(value_cents), SUM(COALESCE(quantity, 0)), COUNT(*)
+                  FROM {schema}.purchases GROUP BY product_id, day, place_id''')
+
+
+def replace_totals(c):
+    # Both rollups from the staged sums; a day can have rows in main and in
+    # an archive (imported after archiving), so they are summed again
+    c.execute("DELETE FROM main.daily_totals")
+    c.execute('''INSERT INTO main.daily_totals (day, kind, method_id, total, count)
+                 SELECT day, kind, method_id, SUM(total), SUM(count) FROM temp.staged_totals
+                 GROUP BY day, kind, method_id''')
+    c.execute("DELETE FROM main.purchase_totals")
+    c.execute('''INSERT INTO main.purchase_totals (product_id, day, place_id, total, quantity, count)
+                 SELECT product_id, day, place_id, SUM(total), SUM(quantity), SUM(count)
+                 FROM temp.staged_purchase_totals GROUP BY product_id, day, place_id''')
+
+
+def rebuild_purchase_totals(c):
+    c.execute("DELETE FROM purchase_totals")
+    c.execute('''INSERT INTO purchase_totals (product_id, day, place_id, total, quantity, count)
+                 SELECT product_id, day, place_id, SUM(value_cents), SUM(COALESCE(quantity, 0)), COUNT(*)
+                 FROM purchases GROUP BY product_id, day, place_id''')
+
+
+MIGRATIONS = [
+    migrate_base_tables,
+    migrate_date_indexes,
+    migrate_daily_totals,
+    migrate_compact_storage,
+    migrate_sale_journal,
+    migrate_archives,
+    migrate_purchase_totals,
+]
+
+# Migrations that rewrite whole tables; the file is vacuumed afterwards so
+# the space they free is returned to the device
+VACUUM_AFTER = {migrate_compact_storage}
+
+# Scheduled maintenance: days between runs, and the share of free pages
+# that makes a vacuum worth doing early
+ANALYZE_EVERY = 7
+VACUUM_EVERY = 30
+VACUUM_FREE_FRACTION = 0.25
+ANALYZE_LIMIT = 1000  # rows sampled per index
+VACUUM_TIMEOUT = 60  # seconds vacuum() waits for a write in progress
+ARCHIVE_TIMEOUT = 60  # seconds archive_year's copy waits for a write to its archive
+ARCHIVE_CHUNK_DAYS = 7  # days of rows archive_year deletes per transaction
+ARCHIVE_PAUSE = 0.005  # seconds between those transactions, for the screens
+
+
+class Database:
+    # One long-lived, tuned connection owned by BusinessApp. Every query the
+    # screens run goes through a method here so statements stay cached.
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        # Bumped by every committed write on this connection; see data_version()
+        self.write_count = 0
+        # instrumentation.Metrics, set by instrument(); None costs nothing
+        self.metrics = None
+        self.conn = self.connect()
+        self.configure()
+        self.init_schema()
+
+    def connect(self):
+        # URI processing on, so ATTACH can pass mode=rw for the archives
+        return sqlite3.connect(sqlite_uri(self.db_path), uri=True, check_same_thread=False, cached_statements=128)
+
+    def configure(self):
+        c = self.conn.cursor()
+        # WAL keeps readers and the writer from blocking each other and turns
+        # each commit into a sequential append; some FUSE mounts refuse it, in
+        # which case SQLite keeps the rollback journal and we carry on.
+        c.execute("PRAGMA journal_mode=WAL")
+        self.journal_mode = c.fetchone()[0]
+        # NORMAL is durable across app kills in WAL mode and avoids an fsync per commit
+        c.execute("PRAGMA synchronous=NORMAL")
+        c.execute("PRAGMA cache_size=-8000")  # ~8 MB page cache
+        c.execute("PRAGMA temp_store=MEMORY")
+
+    def init_schema(self):
+        # Brings any existing business.db up to the latest schema in place
+        with self.lock:
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            applied = MIGRATIONS[version:]
+            for number, migration in enumerate(applied, start=version + 1):
+                c = self.conn.cursor()
+                c.execute("BEGIN")
+                try:
+                    migration(c)
+                    c.execute(f"PRAGMA user_version={number}")
+                except Exception:
+                    self.conn.rollback()
+                    raise
+                self.conn.commit()
+            if VACUUM_AFTER.intersection(applied):
+                self.conn.execute("VACUUM")
+            self.load_name_ids()
+            if self.conn.execute("SELECT 1 FROM maintenance WHERE task='rebuild_totals'").fetchone():
+                try:
+                    self.rebuild_daily_totals()
+                except (OSError, sqlite3.Error) as e:
+                    # The archived years are left out of the rollups until
+                    # their files are back; the app works without them
+                    log.warning(f"Database: rollup rebuild still due: {e}")
+
+    def load_name_ids(self):
+        # name -> id for the small dictionary tables, so inserts don't look them up
+        with self.lock:
+            self.name_ids = {table: dict(self.conn.execute(f"SELECT name, id FROM {table}"))
+                             for table in ('payment_methods', 'places', 'products')}
+
+    @contextmanager
+    def write(self):
+        # Lock plus transaction. A rollback may undo names added by name_id,
+        # so the cached ids are reloaded when one happens.
+        with self.lock:
+            try:
+                with self.conn:
+                    yield self.conn
+            except Exception:
+                self.load_name_ids()
+                raise
+            self.write_count += 1
+
+    def data_version(self):
+        # Changes whenever sales or purchases may have changed: our own commits
+        # bump write_count, and PRAGMA data_version moves when another
+        # connection (a restore, a desktop tool) commits to the file.
+        with self.lock:
+            return self.write_count, self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def name_id(self, table, name):
+        # Id of name in payment_methods/places/products, adding it if new.
+        # Call inside write() so the new name commits with the row using it.
+        ids = self.name_ids[table]
+        if name not in ids:
+            self.conn.execute(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", (name,))
+            ids[name] = self.conn.execute(f"SELECT id FROM {table} WHERE name=?", (name,)).fetchone()[0]
+        return ids[name]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def reopen(self):
+        # Fresh connection to the same file, after a restore replaced its
+        # contents; migrations run again in case the snapshot is older
+        with self.lock:
+            self.conn.close()
+            self.conn = self.connect()
+            self.configure()
+            self.init_schema()
+            if self.metrics is not None:
+                self.metrics.watch(self.conn, self.explain)
+            self.write_count += 1
+
+    def instrument(self, metrics):
+        self.metrics = metrics
+        metrics.watch(self.conn, self.explain)
+
+    def explain(self, sql):
+        # SQLite's plan for one statement, as the lines EXPLAIN QUERY PLAN prints
+        if not sql.lstrip().upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')):
+            return []
+        with self.lock:
+            return [row[3] for row in self.conn.execute("EXPLAIN QUERY PLAN " + sql)]
+
+    def reader(self):
+        # Separate read-only connection for long scans (exports). In WAL mode it
+        # reads a consistent snapshot without holding self.lock, so inserts
+        # from the screens are not blocked while a year of rows streams out.
+        conn = sqlite3.connect(sqlite_uri(self.db_path, 'ro'), uri=True, check_same_thread=False)
+        conn.execute("PRAGMA cache_size=-2000")
+        return conn
+
+    def iter_rows(self, query, params, chunk_size=500, name='db.iter_rows', attach=None):
+        # With metrics attached, only the time spent fetching is recorded,
+        # not the time the caller spends on each row. attach: (schema, path)
+        # of an archive the query reads.
+        conn = self.reader()
+        if attach is not None:
+            schema, path = attach
+            conn.execute(f"ATTACH ? AS {schema}", (sqlite_uri(path, 'ro'),))
+        statements = []
+        if self.metrics is not None:
+            conn.set_trace_callback(statements.append)
+        count = 0
+        fetching = 0.0
+        try:
+            started = time.perf_counter()
+            c = conn.execute(query, params)
+            while True:
+                rows = c.fetchmany(chunk_size)
+                fetching += time.perf_counter() - started
+                if not rows:
+                    break
+                count += len(rows)
+                yield from rows
+                started = time.perf_counter()
+        finally:
+            conn.close()
+            if self.metrics is not None:
+                self.metrics.record(name, fetching * 1000, count, statements)
+
+    def rebuild_daily_totals(self):
+        # Both rollups, from the main tables and every registered archive.
+        # ATTACH cannot run inside a transaction, so each source's sums are
+        # staged in temp tables first and the rollups replaced in a single
+        # one at the end; a missing or unreadable archive raises before
+        # anything is replaced.
+        archives = self.archived_years()
+        missing = sorted(year for year, path in archives.items() if not os.path.exists(path))
+        if missing:
+            raise FileNotFoundError(f"Faltan los archivos de {missing}")
+        with self.lock:
+            self.conn.execute("CREATE TEMP TABLE staged_totals (day, kind, method_id, total, count)")
+            self.conn.execute("CREATE TEMP TABLE staged_purchase_totals "
+                              "(product_id, day, place_id, total, quantity, count)")
+            try:
+                with self.write():
+                    stage_totals(self.conn.cursor(), 'main')
+                for year in archives:
+                    with self.attached(year) as schema:
+                        with self.write():
+                            stage_totals(self.conn.cursor(), schema)
+                with self.write():
+                    replace_totals(self.conn.cursor())
+                    self.conn.execute("DELETE FROM maintenance WHERE task='rebuild_totals'")
+            finally:
+                self.conn.execute("DROP TABLE temp.staged_totals")
+                self.conn.execute("DROP TABLE temp.staged_purchase_totals")
+
+    # Users
+    @instrumented()
+    def check_user(self, username, password):
+        with self.lock:
+            c = self.conn.execute("SELECT 1 FROM users WHERE username=? AND password=?", (username, password))
+            return c.fetchone() is not None
+
+    @instrumented()
+    def add_user(self, username, password):
+        # Returns False when the username is already taken
+        try:
+            with self.write():
+                self.conn.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    # Sales
+    @instrumented()
+    def add_sale(self, date, value, payment_method):
+        with self.write():
+            c = self.conn.execute("INSERT INTO sales (day, value_cents, method_id) VALUES (?, ?, ?)",
+                                  (to_day(date), to_cents(value), self.name_id('payment_methods', payment_method)))
+            return c.lastrowid
+
+    @instrumented(count=int)
+    def add_sales_bulk(self, rows):
+        # rows: [(date, value, payment_method), ...] inserted in one transaction
+        with self.write():
+            self.conn.executemany("INSERT INTO sales (day, value_cents, method_id) VALUES (?, ?, ?)",
+                                  [(to_day(date), to_cents(value), self.name_id('payment_methods', method))
+                                   for date, value, method in rows])
+        return len(rows)
+
+    @instrumented(count=int)
+    def add_sales_journaled(self, rows, seq):
+        # Like add_sales_bulk, and records seq as the last journal entry
+        # committed, atomically with the rows
+        with self.write():
+            self.conn.executemany("INSERT INTO sales (day, value_cents, method_id) VALUES (?, ?, ?)",
+                                  [(to_day(date), to_cents(value), self.name_id('payment_methods', method))
+                                   for date, value, method in rows])
+            self.conn.execute("UPDATE sale_journal SET seq=?", (seq,))
+        return len(rows)
+
+    def journal_seq(self):
+        with self.lock:
+            return self.conn.execute("SELECT seq FROM sale_journal").fetchone()[0]
+
+    @instrumented(count=len)
+    def daily_sales(self, date):
+        # [(payment_method, value), ...] for a single day in entry order
+        with self.lock:
+            c = self.conn.execute("SELECT m.name, s.value_cents FROM sales s "
+                                  "JOIN payment_methods m ON m.id = s.method_id "
+                                  "WHERE s.day=? ORDER BY s.id", (to_day(date),))
+            return [(method, from_cents(cents)) for method, cents in c]
+
+    @instrumented(count=len)
+    def sales_by_method(self, start, end, cents=False):
+        # [(payment_method, total), ...] for an inclusive date range; with
+        # cents the totals stay integer cents, for callers that add them up
+        with self.lock:
+            # Reads at most one row per day and payment method from the rollup
+            c = self.conn.execute(f"SELECT m.name, SUM(t.total) FROM daily_totals t "
+                                  f"JOIN payment_methods m ON m.id = t.method_id "
+                                  f"WHERE t.day BETWEEN ? AND ? AND t.kind={SALE} AND t.count > 0 "
+                                  f"GROUP BY t.method_id ORDER BY t.method_id", (to_day(start), to_day(end)))
+            if cents:
+                return c.fetchall()
+            return [(method, from_cents(total)) for method, total in c]
+
+    @instrumented(count=len)
+    def trend_totals(self, prev_start, prev_end, start, end, granularity, cents=False):
+        # One grouped pass over the rollup for a period and an earlier one:
+        # [(is_current, bucket, kind, payment_method, total)]. Days between
+        # the two periods are left out. bucket is a day number, a Monday-based
+        # week number (day 0 was a Thursday) or year * 12 + month - 1, per
+        # TREND_BUCKETS.
+        bucket = TREND_BUCKETS[granularity]
+        with self.lock:
+            c = self.conn.execute(f"SELECT t.day >= ? AS is_current, {bucket} AS bucket, t.kind, m.name, SUM(t.total) "
+                                  f"FROM daily_totals t LEFT JOIN payment_methods m ON m.id = t.method_id "
+                                  f"WHERE t.day BETWEEN ? AND ? AND (t.day <= ? OR t.day >= ?) AND t.count > 0 "
+                                  f"GROUP BY is_current, bucket, t.kind, t.method_id",
+                                  (to_day(start), to_day(prev_start), to_day(end), to_day(prev_end), to_day(start)))
+            return [(bool(current), b, kind, method, total if cents else from_cents(total))
+                    for current, b, kind, method, total in c]
+
+    @instrumented()
+    def count_sales(self, start, end):
+        with self.lock:
+            c = self.conn.execute(f"SELECT SUM(count) FROM daily_totals "
+                                  f"WHERE day BETWEEN ? AND ? AND kind={SALE}", (to_day(start), to_day(end)))
+            return c.fetchone()[0] or 0
+
+    def iter_sales(self, start, end):
+        # Streams (id, date, payment_method, value) rows in date order
+        return self.iter_ranged("SELECT s.id, date(s.day * 86400, 'unixepoch'), m.name, s.value_cents / 100.0 "
+                                "FROM {schema}.sales s JOIN main.payment_methods m ON m.id = s.method_id "
+                                "WHERE s.day BETWEEN ? AND ?", "s.day, s.id", start, end, 'db.iter_sales')
+
+    # Purchases
+    @instrumented()
+    def add_purchase(self, date, place, product, quantity, value):
+        # Place/product history and the purchase row share one transaction
+        with self.write():
+            c = self.conn.execute("INSERT INTO purchases (day, place_id, product_id, quantity, value_cents) "
+                                  "VALUES (?, ?, ?, ?, ?)",
+                                  (to_day(date), self.name_id('places', place), self.name_id('products', product),
+                                   quantity, to_cents(value)))
+            return c.lastrowid
+
+    @instrumented(count=int)
+    def add_purchases_bulk(self, rows):
+        # rows: [(date, place, product, quantity, value), ...] inserted in one
+        # transaction together with the place/product history
+        with self.write():
+            self.conn.executemany("INSERT INTO purchases (day, place_id, product_id, quantity, value_cents) "
+                                  "VALUES (?, ?, ?, ?, ?)",
+                                  [(to_day(date), self.name_id('places', place), self.name_id('products', product),
+                                    quantity, to_cents(value))
+                                   for date, place, product, quantity, value in rows])
+        return len(rows)
+
+    @instrumented(count=len)
+    def daily_purchases(self, date):
+        # [(place, product, quantity, value), ...] for a single day
+        with self.lock:
+            c = self.conn.execute("SELECT pl.name, pr.name, p.quantity, p.value_cents FROM purchases p "
+                                  "JOIN places pl ON pl.id = p.place_id JOIN products pr ON pr.id = p.product_id "
+                                  "WHERE p.day=? ORDER BY p.id", (to_day(date),))
+            return [(place, product, quantity, from_cents(cents)) for place, product, quantity, cents in c]
+
+    @instrumented(count=len)
+    def place_usage(self):
+        # [(place, times used, last day used), ...] for the suggestion index.
+        # From the rollup, which keeps the archived years as well.
+        with self.lock:
+            return self.conn.execute("SELECT pl.name, SUM(t.count), MAX(t.day) FROM purchase_totals t "
+                                     "JOIN places pl ON pl.id = t.place_id "
+                                     "GROUP BY t.place_id HAVING SUM(t.count) > 0").fetchall()
+
+    @instrumented(count=len)
+    def product_usage(self):
+        with self.lock:
+            return self.conn.execute("SELECT pr.name, SUM(t.count), MAX(t.day) FROM purchase_totals t "
+                                     "JOIN products pr ON pr.id = t.product_id "
+                                     "GROUP BY t.product_id HAVING SUM(t.count) > 0").fetchall()
+
+    @instrumented()
+    def total_purchases(self, start, end, cents=False):
+        with self.lock:
+            c = self.conn.execute(f"SELECT SUM(total) FROM daily_totals "
+                                  f"WHERE day BETWEEN ? AND ? AND kind={PURCHASE}", (to_day(start), to_day(end)))
+            total = c.fetchone()[0] or 0
+            return total if cents else from_cents(total)
+
+    @instrumented()
+    def count_purchases(self, start, end):
+        with self.lock:
+            c = self.conn.execute(f"SELECT SUM(count) FROM daily_totals "
+                                  f"WHERE day BETWEEN ? AND ? AND kind={PURCHASE}", (to_day(start), to_day(end)))
+            return c.fetchone()[0] or 0
+
+    # Purchase cost analytics, all read from purchase_totals
+    @instrumented(count=len)
+    def unit_costs(self, product, start, end, granularity):
+        # [(bucket, total, quantity), ...] for one product, bucket as in
+        # TREND_BUCKETS; unit cost is total / quantity
+        bucket = TREND_BUCKETS[granularity]
+        with self.lock:
+            product_id = self.name_ids['products'].get(product)
+            if product_id is None:
+                return []
+            c = self.conn.execute(f"SELECT {bucket} AS bucket, SUM(t.total), SUM(t.quantity) FROM purchase_totals t "
+                                  f"WHERE t.product_id=? AND t.day BETWEEN ? AND ? AND t.count > 0 "
+                                  f"GROUP BY bucket ORDER BY bucket", (product_id, to_day(start), to_day(end)))
+            return [(b, from_cents(total), quantity) for b, total, quantity in c]
+
+    @instrumented(count=len)
+    def cheapest_places(self, start, end):
+        # [(product, place, unit cost, places compared), ...] by product name:
+        # the place with the lowest total / quantity over the range
+        with self.lock:
+            c = self.conn.execute("SELECT pr.name, pl.name, MIN(unit), COUNT(*) FROM "
+                                  "(SELECT product_id, place_id, SUM(total) * 1.0 / SUM(quantity) AS unit "
+                                  " FROM purchase_totals WHERE day BETWEEN ? AND ? AND count > 0 "
+                                  " GROUP BY product_id, place_id HAVING SUM(quantity) > 0) "
+                                  "JOIN products pr ON pr.id = product_id JOIN places pl ON pl.id = place_id "
+                                  "GROUP BY product_id ORDER BY pr.name", (to_day(start), to_day(end)))
+            # MIN() makes SQLite take the other columns from the cheapest row
+            return [(product, place, from_cents(unit), places) for product, place, unit, places in c]
+
+    @instrumented(count=len)
+    def top_spend(self, start, end, by, limit=10):
+        # [(name, total, quantity, purchases), ...] for the limit biggest
+        # products (by='product') or places (by='place') in the range
+        table, column = {'product': ('products', 'product_id'), 'place': ('places', 'place_id')}[by]
+        with self.lock:
+            # Names are joined to the limit rows only, after grouping
+            c = self.conn.execute(f"SELECT n.name, s.spent, s.quantity, s.count FROM "
+                                  f"(SELECT {column} AS id, SUM(total) AS spent, SUM(quantity) AS quantity, "
+                                  f" SUM(count) AS count FROM purchase_totals "
+                                  f" WHERE day BETWEEN ? AND ? AND count > 0 "
+                                  f" GROUP BY {column} ORDER BY spent DESC LIMIT ?) s "
+                                  f"JOIN {table} n ON n.id = s.id ORDER BY s.spent DESC",
+                                  (to_day(start), to_day(end), limit))
+            return [(name, from_cents(total), quantity, count) for name, total, quantity, count in c]
+
+    def iter_purchases(self, start, end):
+        # Streams (id, date, place, product, quantity, value) rows in date order
+        return self.iter_ranged("SELECT p.id, date(p.day * 86400, 'unixepoch'), pl.name, pr.name, p.quantity, "
+                                "p.value_cents / 100.0 FROM {schema}.purchases p "
+                                "JOIN main.places pl ON pl.id = p.place_id JOIN main.products pr ON pr.id = p.product_id "
+                                "WHERE p.day BETWEEN ? AND ?", "p.day, p.id", start, end, 'db.iter_purchases')
+
+    def iter_ranged(self, select, order, start, end, name):
+        # Runs select ({schema} for the table, ? ? for the day range) over the
+        # main tables and, for the archived years the range overlaps, each
+        # year's archive attached on its own, so one scan never has more than
+        # one archive attached. Rows come out in date order either way.
+        archives = self.archived_years()
+        first, last = to_day(start), to_day(end)
+        while first <= last:
+            year = Date.fromordinal(first + EPOCH_ORDINAL).year
+            if year in archives:
+                segment_end = min(last, to_day(f"{year}-12-31"))
+                query = (f"{select.format(schema='main')} UNION ALL {select.format(schema='archive')} "
+                         f"ORDER BY 2, 1")
+                yield from self.iter_rows(query, (first, segment_end) * 2, name=name,
+                                          attach=('archive', archives[year]))
+            else:
+                # Up to the next archived year, or the end of the range
+                later = [y for y in archives if y > year]
+                segment_end = min(last, to_day(f"{min(later)}-01-01") - 1) if later else last
+                yield from self.iter_rows(f"{select.format(schema='main')} ORDER BY {order}",
+                                          (first, segment_end), name=name)
+            first = segment_end + 1
+
+    # Archives
+    def archive_path(self, year):
+        # business.db -> business-2023.db in the same folder
+        stem, ext = os.path.splitext(self.db_path)
+        return f"{stem}-{year}{ext or '.db'}"
+
+    def archived_years(self):
+        # {year: archive path}, for the archives registered in this database
+        with self.lock:
+            directory = os.path.dirname(self.db_path)
+            return {year: os.path.join(directory, file)
+                    for year, file in self.conn.execute("SELECT year, file FROM archives")}
+
+    @contextmanager
+    def attached(self, year, path=None):
+        # The year's archive attached to the main connection as 'archive'.
+        # ATTACH cannot run inside a transaction, so callers open theirs inside.
+        # A missing file raises instead of being created empty.
+        with self.lock:
+            self.conn.execute("ATTACH ? AS archive", (sqlite_uri(path or self.archive_path(year), 'rw'),))
+            try:
+                yield 'archive'
+            finally:
+                self.conn.execute("DETACH archive")
+
+    def closed_years(self, today=None):
+        # Years before the current one that still have rows in the main tables
+        this_year = (today or Date.today()).year
+        with self.lock:
+            first = self.conn.execute("SELECT MIN(day) FROM (SELECT MIN(day) AS day FROM sales "
+                                      "UNION ALL SELECT MIN(day) FROM purchases)").fetchone()[0]
+            if first is None:
+                return []
+            years = []
+            for year in range(int(from_day(first)[:4]), this_year):
+                bounds = (to_day(f"{year}-01-01"), to_day(f"{year}-12-31"))
+                if (self.conn.execute("SELECT 1 FROM sales WHERE day BETWEEN ? AND ? LIMIT 1", bounds).fetchone()
+                        or self.conn.execute("SELECT 1 FROM purchases WHERE day BETWEEN ? AND ? LIMIT 1",
+                                             bounds).fetchone()):
+                    years.append(year)
+            return years
+
+    @instrumented(count=int)
+    def archive_year(self, year):
+        # Moves the year's sales and purchases into business-<year>.db and
+        # returns how many rows moved. The rollup keeps the year's totals, so
+        # the Balance reports never need the archive; detailed exports attach
+        # it (iter_ranged). db.lock is never held for the whole year, so the
+        # screens and the sale buffer keep going while it runs:
+        #   1. the run is recorded here: a token and the highest row ids, so
+        #      only rows that exist now are moved;
+        #   2. those rows are copied to the archive on a connection of its
+        #      own, and the token is stored with them in the same commit;
+        #   3. they are deleted here ARCHIVE_CHUNK_DAYS at a time, one
+        #      transaction each, the archive registered with the first and
+        #      the run record cleared with the last.
+        # A run cut short resumes from its record on the next call: the copy
+        # is skipped when the archive already holds the token, and the deletes
+        # only take what is left.
+        path = self.archive_path(year)
+        tasks = [f"archive {year} {name}" for name in ('run', 'sales', 'purchases')]
+        with self.write():
+            state = dict(self.conn.execute("SELECT task, last_day FROM maintenance WHERE task IN (?, ?, ?)", tasks))
+            if len(state) < len(tasks):
+                state = dict(zip(tasks, (time.time_ns(),
+                                         self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM sales").fetchone()[0],
+                                         self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM purchases").fetchone()[0])))
+                self.conn.executemany("INSERT OR REPLACE INTO maintenance (task, last_day) VALUES (?, ?)",
+                                      state.items())
+        run, last_sale, last_purchase = (state[task] for task in tasks)
+
+        self.copy_to_archive(year, path, run, last_sale, last_purchase)
+
+        moved = 0
+        first, last = to_day(f"{year}-01-01"), to_day(f"{year}-12-31")
+        for start in range(first, last + 1, ARCHIVE_CHUNK_DAYS):
+            bounds = (start, min(start + ARCHIVE_CHUNK_DAYS - 1, last))
+            with self.write():
+                c = self.conn.cursor()
+                c.execute("INSERT OR REPLACE INTO archives (year, file) VALUES (?, ?)",
+                          (year, os.path.basename(path)))
+                # The delete triggers would take the moved rows out of the
+                # rollups; the chunk's totals are put back as they were
+                c.execute("CREATE TEMP TABLE kept_totals AS SELECT * FROM daily_totals WHERE day BETWEEN ? AND ?",
+                          bounds)
+                c.execute("CREATE TEMP TABLE kept_purchase_totals AS SELECT * FROM purchase_totals "
+                          "WHERE day BETWEEN ? AND ?", bounds)
+                moved += c.execute("DELETE FROM sales WHERE day BETWEEN ? AND ? AND id <= ?",
+                                   (*bounds, last_sale)).rowcount
+                moved += c.execute("DELETE FROM purchases WHERE day BETWEEN ? AND ? AND id <= ?",
+                                   (*bounds, last_purchase)).rowcount
+                c.execute("INSERT OR REPLACE INTO daily_totals SELECT * FROM temp.kept_totals")
+                c.execute("DROP TABLE temp.kept_totals")
+                c.execute("INSERT OR REPLACE INTO purchase_totals SELECT * FROM temp.kept_purchase_totals")
+                c.execute("DROP TABLE temp.kept_purchase_totals")
+                if bounds[1] == last:
+                    c.execute("DELETE FROM maintenance WHERE task IN (?, ?, ?)", tasks)
+            time.sleep(ARCHIVE_PAUSE)
+        return moved
+
+    def copy_to_archive(self, year, path, run, last_sale, last_purchase):
+        # Step 2 of archive_year. It only reads the main database, through a
+        # WAL snapshot, so writers here are not held up. A registered archive
+        # gets the rows added to its year since (an import) with fresh ids; a
+        # new or unregistered one is refilled from scratch.
+        bounds = (to_day(f"{year}-01-01"), to_day(f"{year}-12-31"))
+        registered = year in self.archived_years()
+        conn = sqlite3.connect(sqlite_uri(self.db_path), uri=True, timeout=ARCHIVE_TIMEOUT)
+        try:
+            conn.execute("ATTACH ? AS archive", (sqlite_uri(path, 'rw' if registered else 'rwc'),))
+            c = conn.cursor()
+            create_archive_tables(c, 'archive')
+            c.execute("CREATE TABLE IF NOT EXISTS archive.archive_run (run INTEGER NOT NULL)")
+            if c.execute("SELECT 1 FROM archive.archive_run WHERE run = ?", (run,)).fetchone():
+                return
+            with conn:
+                if registered:
+                    c.execute("INSERT INTO archive.sales (day, value_cents, method_id) "
+                              "SELECT day, value_cents, method_id FROM main.sales "
+                              "WHERE day BETWEEN ? AND ? AND id <= ?", (*bounds, last_sale))
+                    c.execute("INSERT INTO archive.purchases (day, place_id, product_id, quantity, value_cents) "
+                              "SELECT day, place_id, product_id, quantity, value_cents FROM main.purchases "
+                              "WHERE day BETWEEN ? AND ? AND id <= ?", (*bounds, last_purchase))
+                else:
+                    c.execute("DELETE FROM archive.sales")
+                    c.execute("DELETE FROM archive.purchases")
+                    c.execute("INSERT INTO archive.sales SELECT * FROM main.sales "
+                              "WHERE day BETWEEN ? AND ? AND id <= ?", (*bounds, last_sale))
+                    c.execute("INSERT INTO archive.purchases SELECT * FROM main.purchases "
+                              "WHERE day BETWEEN ? AND ? AND id <= ?", (*bounds, last_purchase))
+                c.execute("DELETE FROM archive.archive_run")
+                c.execute("INSERT INTO archive.archive_run (run) VALUES (?)", (run,))
+        finally:
+            conn.close()
+
+    def maintain(self, today=None):
+        # Scheduled upkeep, run in the background at startup: archives closed
+        # years and refreshes the planner statistics every ANALYZE_EVERY days.
+        # A vacuum is due after archiving, every VACUUM_EVERY days, or when
+        # free pages pass VACUUM_FREE_FRACTION of the file; it takes long
+        # enough to stall the screens, so it is only reported here and the
+        # caller runs vacuum() when the app is idle. Returns what it did.
+        today = to_day((today or Date.today()).isoformat())
+        done = {'archived': {}}
+        for year in self.closed_years(Date.fromordinal(today + EPOCH_ORDINAL)):
+            done['archived'][year] = self.archive_year(year)
+
+        with self.lock:
+            last = dict(self.conn.execute("SELECT task, last_day FROM maintenance"))
+            # The first run only starts the clocks
+            last.setdefault('analyze', today - ANALYZE_EVERY)
+            last.setdefault('vacuum', today)
+            pages = self.conn.execute("PRAGMA page_count").fetchone()[0]
+            free = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+            due = {
+                'analyze': today - last['analyze'] >= ANALYZE_EVERY,
+                'vacuum': bool(done['archived'] or (pages and free / pages >= VACUUM_FREE_FRACTION)
+                               or today - last['vacuum'] >= VACUUM_EVERY),
+            }
+            if due['analyze']:
+                # Sampled, so the pause it costs the screens stays short
+                self.conn.execute(f"PRAGMA analysis_limit={ANALYZE_LIMIT}")
+                self.conn.execute("ANALYZE")
+            with self.write():
+                self.conn.executemany("INSERT OR REPLACE INTO maintenance (task, last_day) VALUES (?, ?)",
+                                      [('analyze', today if due['analyze'] else last['analyze']),
+                                       ('vacuum', last['vacuum'])])
+        done.update(due)
+        return done
+
+    def vacuum(self, today=None):
+        # Rewrites the file without its free pages. It runs on a connection
+        # of its own, so db.lock stays free and the screens keep reading;
+        # a write made meanwhile waits for it, up to the busy timeout.
+        today = to_day((today or Date.today()).isoformat())
+        conn = sqlite3.connect(sqlite_uri(self.db_path), uri=True, timeout=VACUUM_TIMEOUT)
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        with self.write():
+            self.conn.execute("INSERT OR REPLACE INTO maintenance (task, last_day) VALUES ('vacuum', ?)", (today,))
+
+if __name__ == '__main__':
+    # python database.py rebuild-totals|maintain [path/to/business.db]
+    import sys
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ('rebuild-totals', 'maintain'):
+        sys.exit("usage: python database.py rebuild-totals|maintain [db_path]")
+    db = Database(sys.argv[2] if len(sys.argv) > 2 else DB_PATH)
+    if sys.argv[1] == 'rebuild-totals':
+        db.rebuild_daily_totals()
+    else:
+        done = db.maintain()
+        if done['vacuum']:
+            db.vacuum()
+        print(done)
+    db.close()
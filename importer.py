@@ -0,0 +1,148 @@
+# Bulk import of historical sales and purchases from CSV or XLSX files
+import csv
+import os
+from datetime import date, datetime
+from database import validate_date, validate_sale, validate_purchase
+
+BATCH_SIZE = 5000
+
+# Accepted header names per field, Spanish first as in the exports
+SALES_COLUMNS = {
+    'date': ("fecha", "date"),
+    'value': ("valor", "value"),
+    'payment_method': ("modo de pago", "payment_method", "metodo de pago", "método de pago"),
+}
+PURCHASES_COLUMNS = {
+    'date': ("fecha", "date"),
+    'place': ("lugar", "lugar de compra", "place"),
+    'product': ("producto", "product"),
+    'quantity': ("cantidad", "cantidad/peso", "quantity"),
+    'value': ("valor", "value"),
+}
+
+
+def cell_text(cell):
+    if cell is None:
+        return ""
+    if isinstance(cell, (datetime, date)):
+        return cell.strftime("%Y-%m-%d")
+    return str(cell).strip()
+
+
+def read_csv(file_path, progress):
+    # Yields rows as lists of strings; progress follows the bytes read
+    total = max(os.path.getsize(file_path), 1)
+    read = 0
+    with open(file_path, newline='', encoding='utf-8-sig') as f:
+        def lines():
+            nonlocal read
+            for line in f:
+                read += len(line.encode('utf-8'))
+                yield line
+
+        for i, row in enumerate(csv.reader(lines())):
+            if i % BATCH_SIZE == 0:
+                progress(read / total)
+            yield row
+
+
+def read_xlsx(file_path, progress):
+    import openpyxl
+
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        total = max(ws.max_row or 0, 1)
+        for i, row in enumerate(ws.iter_rows(values_only=True)):
+            if i % BATCH_SIZE == 0:
+                progress(i / total)
+            yield row
+    finally:
+        wb.close()
+
+
+def column_indexes(header, columns):
+    header = [cell_text(name).lower() for name in header]
+    indexes = {}
+    for field, names in columns.items():
+        for name in names:
+            if name in header:
+                indexes[field] = header.index(name)
+                break
+        else:
+            raise ValueError(f"Falta la columna '{names[0]}'")
+    return indexes
+
+
+def parse_sale(cells):
+    sale_date = validate_date(cells['date'])
+    value, method = validate_sale(cells['value'], cells['payment_method'])
+    return sale_date, value, method
+
+
+def parse_purchase(cells):
+    purchase_date = validate_date(cells['date'])
+    place, product, qty, value = validate_purchase(cells['place'], cells['product'],
+                                                   cells['quantity'], cells['value'])
+    return purchase_date, place, product, qty, value
+
+
+def import_file(db, kind, file_path, progress=None):
+    # kind is 'sales' or 'purchases'. Rows are validated with the screens'
+    # rules and written in BATCH_SIZE executemany batches, one transaction
+    # per batch. Returns {'imported': n, 'rejected': [(line, reason), ...]}.
+    progress = progress or (lambda fraction: None)
+    if kind == 'sales':
+        columns, parse, insert = SALES_COLUMNS, parse_sale, db.add_sales_bulk
+    elif kind == 'purchases':
+        columns, parse, insert = PURCHASES_COLUMNS, parse_purchase, db.add_purchases_bulk
+    else:
+        raise ValueError(f"Tipo de importación desconocido: {kind}")
+
+    if file_path.lower().endswith('.xlsx'):
+        rows = read_xlsx(file_path, progress)
+    else:
+        rows = read_csv(file_path, progress)
+
+    imported = 0
+    rejected = []
+    batch = []
+    try:
+        header = next(rows, None)
+        if header is None:
+            raise ValueError("Archivo vacío")
+        indexes = column_indexes(header, columns)
+        for line, row in enumerate(rows, start=2):
+            if not any(cell_text(cell) for cell in row):
+                continue
+            try:
+                cells = {field: cell_text(row[i]) if i < len(row) else "" for field, i in indexes.items()}
+                batch.append(parse(cells))
+            except (ValueError, OverflowError) as e:
+                rejected.append((line, str(e)))
+                continue
+            if len(batch) >= BATCH_SIZE:
+                imported += insert(batch)
+                batch = []
+        if batch:
+            imported += insert(batch)
+    finally:
+        rows.close()
+
+    progress(1)
+    return {'imported': imported, 'rejected': rejected}
+
+
+if __name__ == '__main__':
+    # python importer.py sales|purchases file.csv|file.xlsx [db_path]
+    import sys
+    from database import Database, DB_PATH
+
+    if len(sys.argv) < 3 or sys.argv[1] not in ('sales', 'purchases'):
+        sys.exit("usage: python importer.py sales|purchases <file> [db_path]")
+    db = Database(sys.argv[3] if len(sys.argv) > 3 else DB_PATH)
+    result = import_file(db, sys.argv[1], sys.argv[2])
+    db.close()
+    print(f"Importadas: {result['imported']}")
+    for line, reason in result['rejected']:
+        print(f"Fila {line} rechazada: {reason}")
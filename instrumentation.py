@@ -0,0 +1,187 @@
+# Latency histograms, row counts and a slow-operation log
+#
+# Database methods and screen handlers report how long they took; anything
+# slower than SLOW_MS is kept with the SQL it ran and SQLite's query plan
+# for it. The hidden diagnostics screen shows snapshot() and can export it
+# as JSON for a shop to send in.
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# Upper bounds of the histogram buckets in milliseconds; one more bucket
+# catches everything slower
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+SLOW_MS = 100
+MAX_SLOW = 50
+MAX_STATEMENTS = 10  # SQL kept per timed call; a bulk insert runs thousands
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+
+    def add(self, ms, rows=None):
+        i = 0
+        while i < len(BUCKETS_MS) and ms > BUCKETS_MS[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        if rows is not None:
+            self.rows += rows
+
+    def percentile(self, p):
+        # Upper bound of the bucket holding the p-th percentile (max_ms for the last one)
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else round(self.max_ms, 1)
+        return 0
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else 0,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'max_ms': round(self.max_ms, 3),
+            'rows': self.rows,
+            'buckets': {f"<={bound}ms": n for bound, n in zip(BUCKETS_MS, self.buckets)}
+                       | {f">{BUCKETS_MS[-1]}ms": self.buckets[-1]},
+        }
+
+
+class Metrics:
+    # Thread-safe: database calls are timed on the worker threads, screen
+    # handlers on the UI thread
+    def __init__(self, slow_ms=SLOW_MS, max_slow=MAX_SLOW):
+        self.slow_ms = slow_ms
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.slow = deque(maxlen=max_slow)
+        self.local = threading.local()
+        self.explain = None
+        self.started = datetime.now().isoformat(timespec='seconds')
+
+    def watch(self, conn, explain):
+        # Captures the statements conn runs while a timed call is in progress;
+        # explain(sql) -> [plan line, ...] is used for the slow ones
+        conn.set_trace_callback(self.statement)
+        self.explain = explain
+
+    def statement(self, sql):
+        statements = getattr(self.local, 'statements', None)
+        if statements is None or len(statements) >= MAX_STATEMENTS:
+            return
+        # Trigger bodies are reported as comments, and SQLite reports the
+        # parent statement again for each of them; one copy is enough
+        if not sql.startswith('--') and (not statements or statements[-1] != sql):
+            statements.append(sql)
+
+    def record(self, name, ms, rows=None, statements=()):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(ms, rows)
+        if ms >= self.slow_ms:
+            self.record_slow(name, ms, rows, statements)
+
+    def record_slow(self, name, ms, rows, statements):
+        queries = []
+        for sql in statements:
+            try:
+                plan = self.explain(sql) if self.explain else []
+            except Exception as e:
+                plan = [f"EXPLAIN QUERY PLAN failed: {e}"]
+            queries.append({'sql': sql, 'plan': plan})
+        entry = {
+            'name': name,
+            'ms': round(ms, 3),
+            'rows': rows,
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'queries': queries,
+        }
+        with self.lock:
+            self.slow.append(entry)
+
+    def call(self, name, fn, *args, count=None, **kwargs):
+        # Runs fn, recording its latency, count(result) rows and, when slow, its SQL
+        outer = getattr(self.local, 'statements', None)
+        self.local.statements = statements = []
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            ms = (time.perf_counter() - started) * 1000
+            self.local.statements = outer
+            if outer is not None:
+                outer.extend(statements)
+        self.record(name, ms, count(result) if count else None, statements)
+        return result
+
+    def timer(self, name):
+        # For work that finishes in a callback: done = metrics.timer(name);
+        # ...; done(rows). Only the first call to done is recorded.
+        started = time.perf_counter()
+        finished = []
+
+        def done(rows=None):
+            if not finished:
+                finished.append(True)
+                self.record(name, (time.perf_counter() - started) * 1000, rows)
+        return done
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.slow.clear()
+            self.started = datetime.now().isoformat(timespec='seconds')
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'since': self.started,
+                'at': datetime.now().isoformat(timespec='seconds'),
+                'slow_ms': self.slow_ms,
+                'operations': {name: h.as_dict() for name, h in sorted(self.histograms.items())},
+                'slow': list(self.slow),
+            }
+
+    def export(self, path, extra=None):
+        # Writes snapshot() (plus extra, e.g. startup timings) as JSON
+        data = self.snapshot()
+        if extra:
+            data.update(extra)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path + '.part', 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(path + '.part', path)
+        return path
+
+
+def format_snapshot(snapshot):
+    # Text for the diagnostics screen: one line per operation, slowest first
+    lines = [f"Desde {snapshot['since']}", ""]
+    operations = sorted(snapshot['operations'].items(), key=lambda item: -item[1]['p95_ms'])
+    for name, h in operations:
+        lines.append(f"{name}: n={h['count']} p50≤{h['p50_ms']}ms p95≤{h['p95_ms']}ms "
+                     f"max={h['max_ms']:.0f}ms filas={h['rows']}")
+    if snapshot['slow']:
+        lines += ["", f"Lentas (≥{snapshot['slow_ms']} ms):"]
+        for entry in reversed(snapshot['slow']):
+            lines.append(f"{entry['at']} {entry['name']} {entry['ms']:.0f}ms")
+            for query in entry['queries']:
+                lines.append(f"  {query['sql'][:80]}")
+                lines += [f"    {step}" for step in query['plan']]
+    return lines
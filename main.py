@@ -1,7 +1,9 @@
 # APK build ready
-import sqlite3
-from datetime import datetime, timedelta
+import time
+STARTED = time.perf_counter()
+from datetime import datetime
 import os
+import json
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.label import Label
@@ -9,39 +11,133 @@ from kivy.uix.textinput import TextInput
 from kivy.uix.button import Button
 from kivy.uix.popup import Popup
 from kivy.uix.spinner import Spinner
+from kivy.uix.progressbar import ProgressBar
+from kivy.uix.filechooser import FileChooserListView
+from kivy.uix.screenmanager import ScreenManager, Screen, NoTransition
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.uix.widget import Widget
+from kivy.graphics import Color, Line, Rectangle
 from kivy.metrics import dp
-from fpdf import FPDF
-import openpyxl
-
-# Database setup
-def init_db():
-    db_path = os.path.join('/sdcard', 'business.db')  # Ruta para Android
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    
-    # Users table
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (username TEXT PRIMARY KEY, password TEXT)''')
-    
-    # Sales table
-    c.execute('''CREATE TABLE IF NOT EXISTS sales
-                 (id INTEGER PRIMARY KEY, date TEXT, value REAL, payment_method TEXT)''')
-    
-    # Purchases table
-    c.execute('''CREATE TABLE IF NOT EXISTS purchases
-                 (id INTEGER PRIMARY KEY, date TEXT, place TEXT, product TEXT, quantity REAL, value REAL)''')
-    
-    # Places history
-    c.execute('''CREATE TABLE IF NOT EXISTS places
-                 (name TEXT UNIQUE)''')
-    
-    # Products history
-    c.execute('''CREATE TABLE IF NOT EXISTS products
-                 (name TEXT UNIQUE)''')
-    
-    conn.commit()
-    conn.close()
-    return db_path
+from kivy.logger import Logger
+from database import Database, PAYMENT_METHODS, validate_sale, validate_purchase, from_cents, to_cents
+from worker import Worker, TaskCancelled
+import reports
+import importer
+from suggestions import PrefixIndex
+from salebuffer import SaleBuffer
+from instrumentation import Metrics, format_snapshot
+import backup
+
+IMPORTED = time.perf_counter()
+
+
+def record_startup(path, timings):
+    # One JSON line per cold start so releases can be compared
+    entry = dict(timings, date=datetime.now().isoformat(timespec='seconds'))
+    with open(path, 'a') as f:
+        f.write(json.dumps(entry) + "\n")
+
+# Transaction list
+class TransactionList(RecycleView):
+    # Only the rows on screen get widgets, so a long day scrolls smoothly
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.viewclass = 'Label'
+        layout = RecycleBoxLayout(orientation='vertical', size_hint_y=None,
+                                  default_size=(None, dp(28)), default_size_hint=(1, None))
+        layout.bind(minimum_height=layout.setter('height'))
+        self.add_widget(layout)
+
+    def append(self, text):
+        self.data.append({'text': text, 'font_size': dp(14), 'color': (0, 0, 0, 1)})
+
+# Suggestion bar
+class SuggestionBar(BoxLayout):
+    # Tappable suggestions under a TextInput, answered from a PrefixIndex on
+    # every keystroke. The buttons are created once and only relabelled.
+    def __init__(self, text_input, limit=3, **kwargs):
+        super().__init__(orientation='horizontal', spacing=dp(5), size_hint=(1, 0.15), **kwargs)
+        self.text_input = text_input
+        self.limit = limit
+        self.index = None
+        self.buttons = []
+        for _ in range(limit):
+            button = Button(text="", font_size=dp(14), background_color=(1, 0.84, 0, 1))
+            button.bind(on_press=self.pick)
+            self.buttons.append(button)
+            self.add_widget(button)
+        self.show([])
+        text_input.bind(text=self.on_text)
+
+    def on_text(self, instance, text):
+        if self.index is None:
+            return
+        self.show([name for name in self.index.suggest(text, self.limit) if name != text])
+
+    def show(self, names):
+        for i, button in enumerate(self.buttons):
+            button.text = names[i] if i < len(names) else ""
+            button.disabled = i >= len(names)
+            button.opacity = 1 if i < len(names) else 0
+
+    def pick(self, button):
+        self.text_input.text = button.text
+
+# Trend chart
+class TrendChart(Widget):
+    # Sales (green) and purchases (red) bars per bucket, with profit as a
+    # line and the previous period's profit as a grey line behind it
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.trend = None
+        self.bind(pos=self.redraw, size=self.redraw)
+
+    def show(self, trend):
+        self.trend = trend
+        self.redraw()
+
+    def redraw(self, *args):
+        self.canvas.clear()
+        trend = self.trend
+        if not trend or not trend['labels']:
+            return
+        
+        # The previous period's profit is drawn under the current one only
+        # when its buckets line up with the current period's
+        previous = trend['previous']['profit']
+        if len(previous) != len(trend['labels']):
+            previous = []
+        values = trend['total_sales'] + trend['purchases'] + trend['profit'] + previous + [0]
+        top, bottom = max(values), min(values)
+        span = (top - bottom) or 1
+        slot = self.width / len(trend['labels'])
+        bar = slot * 0.4
+
+        def y(value):
+            return self.y + (value - bottom) / span * self.height
+
+        def line_points(series):
+            points = []
+            for i, value in enumerate(series[:len(trend['labels'])]):
+                points += [self.x + (i + 0.5) * slot, y(value)]
+            return points
+
+        with self.canvas:
+            Color(0.8, 0.8, 0.8, 1)
+            Line(points=[self.x, y(0), self.right, y(0)], width=1)
+            for i, (sales, purchases) in enumerate(zip(trend['total_sales'], trend['purchases'])):
+                x = self.x + i * slot + slot * 0.1
+                Color(0.2, 0.6, 0.2, 1)
+                Rectangle(pos=(x, y(0)), size=(bar, y(sales) - y(0)))
+                Color(0.8, 0.2, 0.2, 1)
+                Rectangle(pos=(x + bar, y(0)), size=(bar, y(purchases) - y(0)))
+            if len(trend['labels']) > 1:
+                if previous:
+                    Color(0.6, 0.6, 0.6, 1)
+                    Line(points=line_points(previous), width=1)
+                Color(0, 0, 0, 1)
+                Line(points=line_points(trend['profit']), width=1.5)
 
 # Login Screen
 class LoginScreen(BoxLayout):
@@ -51,7 +147,7 @@ class LoginScreen(BoxLayout):
         self.orientation = 'vertical'
         self.padding = dp(20)
         self.spacing = dp(10)
-        self.db_path = init_db()
+        self.db = app.db
         
         # Username input
         self.add_widget(Label(text="Usuario:", font_size=dp(20), color=(0, 0, 0, 1)))
@@ -72,20 +168,23 @@ class LoginScreen(BoxLayout):
         self.register_button.bind(on_press=self.register)
         self.add_widget(self.register_button)
 
+    def refresh(self):
+        self.pass_input.text = ""
+
     def login(self, instance):
         username = self.user_input.text
         password = self.pass_input.text
         
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute("SELECT * FROM users WHERE username=? AND password=?", (username, password))
-        user = c.fetchone()
-        conn.close()
-        
-        if user:
+        done = self.app.metrics.timer('ui.login')
+        self.app.worker.run(self.db.check_user, username, password,
+                            on_done=lambda valid: self.on_login(username, valid, done))
+
+    def on_login(self, username, valid, done=None):
+        if done is not None:
+            done()
+        if valid:
             self.app.username = username
-            self.app.root.clear_widgets()
-            self.app.root.add_widget(MainMenuScreen(self.app))
+            self.app.show_screen('menu')
         else:
             self.show_popup("Error", "Credenciales inválidas")
 
@@ -97,15 +196,13 @@ class LoginScreen(BoxLayout):
             self.show_popup("Error", "Campos requeridos")
             return
         
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        try:
-            c.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
-            conn.commit()
+        self.app.worker.run(self.db.add_user, username, password, on_done=self.on_register)
+
+    def on_register(self, created):
+        if created:
             self.show_popup("Éxito", "Usuario registrado")
-        except sqlite3.IntegrityError:
+        else:
             self.show_popup("Error", "Usuario ya existe")
-        conn.close()
 
     def show_popup(self, title, message):
         popup = Popup(title=title, content=Label(text=message), size_hint=(0.8, 0.4))
@@ -120,7 +217,10 @@ class MainMenuScreen(BoxLayout):
         self.padding = dp(20)
         self.spacing = dp(10)
         
-        self.add_widget(Label(text=f"Bienvenido, {self.app.username}", font_size=dp(24), color=(0, 0, 0, 1)))
+        self.welcome_label = Label(text="", font_size=dp(24), color=(0, 0, 0, 1))
+        self.welcome_label.bind(on_touch_down=self.on_welcome_touch)
+        self.add_widget(self.welcome_label)
+        self.welcome_taps = []
         
         sales_button = Button(text="Ventas", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
         sales_button.bind(on_press=self.go_to_sales)
@@ -134,25 +234,119 @@ class MainMenuScreen(BoxLayout):
         balance_button.bind(on_press=self.go_to_balance)
         self.add_widget(balance_button)
         
+        analytics_button = Button(text="Análisis de Compras", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
+        analytics_button.bind(on_press=self.go_to_analytics)
+        self.add_widget(analytics_button)
+        
+        import_button = Button(text="Importar Datos", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
+        import_button.bind(on_press=self.open_import)
+        self.add_widget(import_button)
+        
+        backup_button = Button(text="Copias de Seguridad", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
+        backup_button.bind(on_press=self.go_to_backups)
+        self.add_widget(backup_button)
+        
         logout_button = Button(text="Cerrar Sesión", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
         logout_button.bind(on_press=self.logout)
         self.add_widget(logout_button)
 
+    def refresh(self):
+        self.welcome_label.text = f"Bienvenido, {self.app.username}"
+
+    def on_welcome_touch(self, label, touch):
+        # Five quick taps on the greeting open the diagnostics screen
+        if not label.collide_point(*touch.pos):
+            return False
+        now = time.perf_counter()
+        self.welcome_taps = [t for t in self.welcome_taps if now - t < 3] + [now]
+        if len(self.welcome_taps) >= 5:
+            self.welcome_taps = []
+            self.app.show_screen('diagnostics')
+        return True
+
     def go_to_sales(self, instance):
-        self.app.root.clear_widgets()
-        self.app.root.add_widget(SalesScreen(self.app))
+        self.app.show_screen('sales')
 
     def go_to_purchases(self, instance):
-        self.app.root.clear_widgets()
-        self.app.root.add_widget(PurchasesScreen(self.app))
+        self.app.show_screen('purchases')
 
     def go_to_balance(self, instance):
-        self.app.root.clear_widgets()
-        self.app.root.add_widget(BalanceScreen(self.app))
+        self.app.show_screen('balance')
+
+    def go_to_analytics(self, instance):
+        self.app.show_screen('analytics')
+
+    def open_import(self, instance):
+        ImportPopup(self.app).open()
+
+    def go_to_backups(self, instance):
+        self.app.show_screen('backups')
 
     def logout(self, instance):
-        self.app.root.clear_widgets()
-        self.app.root.add_widget(LoginScreen(self.app))
+        self.app.username = None
+        self.app.show_screen('login')
+
+# Import Popup
+class ImportPopup(Popup):
+    def __init__(self, app, **kwargs):
+        super().__init__(title="Importar Datos", size_hint=(0.95, 0.9), auto_dismiss=False, **kwargs)
+        self.app = app
+        content = BoxLayout(orientation='vertical', spacing=dp(10))
+        
+        start_path = reports.EXPORT_DIR if os.path.isdir(reports.EXPORT_DIR) else os.getcwd()
+        self.chooser = FileChooserListView(path=start_path, filters=['*.csv', '*.xlsx'])
+        content.add_widget(self.chooser)
+        
+        self.kind = Spinner(text="Ventas", values=["Ventas", "Compras"], font_size=dp(16), size_hint=(1, 0.1))
+        content.add_widget(self.kind)
+        
+        self.progress = ProgressBar(max=1, value=0, size_hint=(1, 0.05))
+        content.add_widget(self.progress)
+        
+        self.import_button = Button(text="Importar", size_hint=(1, 0.1), background_color=(1, 0.84, 0, 1))
+        self.import_button.bind(on_press=self.start_import)
+        content.add_widget(self.import_button)
+        
+        self.close_button = Button(text="Cerrar", size_hint=(1, 0.1), background_color=(1, 0.84, 0, 1))
+        self.close_button.bind(on_press=self.dismiss)
+        content.add_widget(self.close_button)
+        self.content = content
+
+    def start_import(self, instance):
+        if not self.chooser.selection:
+            self.show_popup("Error", "Seleccione un archivo")
+            return
+        
+        kind = 'sales' if self.kind.text == "Ventas" else 'purchases'
+        self.import_button.disabled = self.close_button.disabled = True
+        self.app.worker.run(importer.import_file, self.app.db, kind, self.chooser.selection[0],
+                            on_done=lambda result: self.on_imported(result, kind), on_error=self.on_error,
+                            on_progress=self.on_progress)
+
+    def on_progress(self, fraction):
+        self.progress.value = fraction
+
+    def on_imported(self, result, kind='sales'):
+        self.import_button.disabled = self.close_button.disabled = False
+        # Imported places and products are suggested from now on
+        purchases = self.app.screens.views.get('purchases')
+        if kind == 'purchases' and result['imported'] and purchases is not None:
+            purchases.reload_suggestions()
+        rejected = result['rejected']
+        text = f"Importadas: {result['imported']}\nRechazadas: {len(rejected)}"
+        for line, reason in rejected[:5]:
+            text += f"\nFila {line}: {reason}"
+        if len(rejected) > 5:
+            text += "\n..."
+        self.show_popup("Importación", text)
+
+    def on_error(self, error):
+        self.import_button.disabled = self.close_button.disabled = False
+        self.show_popup("Error", str(error))
+
+    def show_popup(self, title, message):
+        popup = Popup(title=title, content=Label(text=message), size_hint=(0.8, 0.4))
+        popup.open()
 
 # Sales Screen
 class SalesScreen(BoxLayout):
@@ -162,10 +356,10 @@ class SalesScreen(BoxLayout):
         self.orientation = 'vertical'
         self.padding = dp(20)
         self.spacing = dp(10)
-        self.db_path = app.db_path
+        self.db = app.db
         
-        today = datetime.now().strftime("%Y-%m-%d")
-        self.add_widget(Label(text=f"Fecha: {today}", font_size=dp(20), color=(0, 0, 0, 1)))
+        self.date_label = Label(text="", font_size=dp(20), color=(0, 0, 0, 1))
+        self.add_widget(self.date_label)
         
         self.add_widget(Label(text="Valor de la Venta:", font_size=dp(16), color=(0, 0, 0, 1)))
         self.sale_value = TextInput(font_size=dp(16), multiline=False)
@@ -174,69 +368,93 @@ class SalesScreen(BoxLayout):
         self.add_widget(Label(text="Modo de Pago:", font_size=dp(16), color=(0, 0, 0, 1)))
         self.payment_method = Spinner(
             text="Efectivo",
-            values=["Efectivo", "Nequi", "Transferencia", "Deuda"],
+            values=PAYMENT_METHODS,
             font_size=dp(16)
         )
         self.add_widget(self.payment_method)
         
-        add_button = Button(text="Agregar Venta", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
-        add_button.bind(on_press=self.add_sale)
-        self.add_widget(add_button)
+        self.add_button = Button(text="Agregar Venta", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
+        self.add_button.bind(on_press=self.add_sale)
+        self.add_widget(self.add_button)
+        
+        self.totals_label = Label(text="", font_size=dp(14), color=(0, 0, 0, 1), size_hint=(1, 0.3))
+        self.add_widget(self.totals_label)
         
-        self.sales_list = Label(text="", font_size=dp(14), color=(0, 0, 0, 1), text_size=(None, None), size_hint=(1, 1))
+        self.sales_list = TransactionList(size_hint=(1, 1))
         self.add_widget(self.sales_list)
+        self.totals = {}
         
         back_button = Button(text="Volver", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
         back_button.bind(on_press=self.back_to_menu)
         self.add_widget(back_button)
-        
+
+    def refresh(self):
+        # The screen is reused, so the date may have rolled over since it was built
+        self.date_label.text = f"Fecha: {datetime.now().strftime('%Y-%m-%d')}"
         self.load_daily_sales()
 
     def add_sale(self, instance):
-        value = self.sale_value.text
-        method = self.payment_method.text
-        if not value or not method:
-            self.show_popup("Error", "Campos requeridos")
-            return
         try:
-            value = float(value)
-        except ValueError:
-            self.show_popup("Error", "Valor inválido")
+            value, method = validate_sale(self.sale_value.text, self.payment_method.text)
+        except ValueError as e:
+            self.show_popup("Error", str(e))
             return
         
         today = datetime.now().strftime("%Y-%m-%d")
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute("INSERT INTO sales (date, value, payment_method) VALUES (?, ?, ?)", (today, value, method))
-        conn.commit()
-        conn.close()
-        
+        # Journaled and acknowledged right away; the buffer commits it shortly
+        done = self.app.metrics.timer('ui.add_sale')
+        try:
+            self.app.sales.add(today, value, method)
+        except (OSError, RuntimeError) as e:
+            self.show_popup("Error", str(e))
+            return
+        done(1)
+        self.on_sale_added(method, value)
+
+    def on_sale_added(self, method, value):
         self.show_popup("Éxito", "Venta agregada")
-        self.load_daily_sales()
+        # The new row is appended in memory; the day is not queried again
+        self.append_sale(method, value)
+        self.show_totals()
 
     def load_daily_sales(self):
-        self.sales_list.text = ""
         today = datetime.now().strftime("%Y-%m-%d")
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute("SELECT payment_method, SUM(value) FROM sales WHERE date=? GROUP BY payment_method", (today,))
-        results = c.fetchall()
-        total = 0
-        text = ""
+        done = self.app.metrics.timer('ui.load_daily_sales')
+        self.app.worker.run(self.read_daily_sales, today,
+                            on_done=lambda results: self.show_daily_sales(results, done))
+
+    def read_daily_sales(self, today):
+        # Runs on the worker; sales still in the buffer are committed first
+        self.app.sales.flush()
+        return self.db.daily_sales(today)
+
+    def show_daily_sales(self, results, done=None):
+        self.sales_list.data = []
+        self.totals = {}
         for method, val in results:
-            text += f"{method}: {val}\n"
-            total += val
-        text += f"Total: {total}"
-        self.sales_list.text = text
-        conn.close()
+            self.append_sale(method, val)
+        self.show_totals()
+        if done is not None:
+            done(len(results))
+
+    def append_sale(self, method, value):
+        self.sales_list.append(f"{method}: {value}")
+        # Kept in cents so the running totals don't drift
+        self.totals[method] = self.totals.get(method, 0) + to_cents(value)
+
+    def show_totals(self):
+        text = ""
+        for method, cents in self.totals.items():
+            text += f"{method}: {from_cents(cents)}\n"
+        text += f"Total: {from_cents(sum(self.totals.values()))}"
+        self.totals_label.text = text
 
     def show_popup(self, title, message):
         popup = Popup(title=title, content=Label(text=message), size_hint=(0.8, 0.4))
         popup.open()
 
     def back_to_menu(self, instance):
-        self.app.root.clear_widgets()
-        self.app.root.add_widget(MainMenuScreen(self.app))
+        self.app.show_screen('menu')
 
 # Purchases Screen
 class PurchasesScreen(BoxLayout):
@@ -246,18 +464,22 @@ class PurchasesScreen(BoxLayout):
         self.orientation = 'vertical'
         self.padding = dp(20)
         self.spacing = dp(10)
-        self.db_path = app.db_path
+        self.db = app.db
         
-        today = datetime.now().strftime("%Y-%m-%d")
-        self.add_widget(Label(text=f"Fecha: {today}", font_size=dp(20), color=(0, 0, 0, 1)))
+        self.date_label = Label(text="", font_size=dp(20), color=(0, 0, 0, 1))
+        self.add_widget(self.date_label)
         
         self.add_widget(Label(text="Lugar de Compra:", font_size=dp(16), color=(0, 0, 0, 1)))
         self.place_input = TextInput(font_size=dp(16), multiline=False)
         self.add_widget(self.place_input)
+        self.place_suggestions = SuggestionBar(self.place_input)
+        self.add_widget(self.place_suggestions)
         
         self.add_widget(Label(text="Producto:", font_size=dp(16), color=(0, 0, 0, 1)))
         self.product_input = TextInput(font_size=dp(16), multiline=False)
         self.add_widget(self.product_input)
+        self.product_suggestions = SuggestionBar(self.product_input)
+        self.add_widget(self.product_suggestions)
         
         self.add_widget(Label(text="Cantidad/Peso:", font_size=dp(16), color=(0, 0, 0, 1)))
         self.quantity = TextInput(font_size=dp(16), multiline=False)
@@ -267,85 +489,94 @@ class PurchasesScreen(BoxLayout):
         self.purchase_value = TextInput(font_size=dp(16), multiline=False)
         self.add_widget(self.purchase_value)
         
-        add_button = Button(text="Agregar Producto", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
-        add_button.bind(on_press=self.add_purchase)
-        self.add_widget(add_button)
+        self.add_button = Button(text="Agregar Producto", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
+        self.add_button.bind(on_press=self.add_purchase)
+        self.add_widget(self.add_button)
         
-        self.purchases_list = Label(text="", font_size=dp(14), color=(0, 0, 0, 1), text_size=(None, None), size_hint=(1, 1))
+        self.total_label = Label(text="", font_size=dp(14), color=(0, 0, 0, 1), size_hint=(1, 0.2))
+        self.add_widget(self.total_label)
+        
+        self.purchases_list = TransactionList(size_hint=(1, 1))
         self.add_widget(self.purchases_list)
+        self.total = 0
+        
+        # The suggestion indexes are loaded once and then kept current on
+        # insert; a bulk import reloads them
+        self.reload_suggestions()
         
         back_button = Button(text="Volver", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
         back_button.bind(on_press=self.back_to_menu)
         self.add_widget(back_button)
-        
+
+    def refresh(self):
+        self.date_label.text = f"Fecha: {datetime.now().strftime('%Y-%m-%d')}"
         self.load_daily_purchases()
 
+    def reload_suggestions(self):
+        self.app.worker.run(self.load_suggestions, on_done=self.set_suggestions)
+
+    def load_suggestions(self):
+        return PrefixIndex(self.db.place_usage()), PrefixIndex(self.db.product_usage())
+
+    def set_suggestions(self, indexes):
+        self.place_suggestions.index, self.product_suggestions.index = indexes
+
     def add_purchase(self, instance):
-        place = self.place_input.text
-        product = self.product_input.text
-        qty = self.quantity.text
-        value = self.purchase_value.text
-        
-        if not all([place, product, qty, value]):
-            self.show_popup("Error", "Campos requeridos")
-            return
-        
         try:
-            qty = float(qty)
-            value = float(value)
-        except ValueError:
-            self.show_popup("Error", "Valores inválidos")
+            place, product, qty, value = validate_purchase(self.place_input.text, self.product_input.text,
+                                                           self.quantity.text, self.purchase_value.text)
+        except ValueError as e:
+            self.show_popup("Error", str(e))
             return
         
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        
-        # Add place if new
-        try:
-            c.execute("INSERT INTO places (name) VALUES (?)", (place,))
-            conn.commit()
-        except sqlite3.IntegrityError:
-            pass
-        
-        # Add product if new
-        try:
-            c.execute("INSERT INTO products (name) VALUES (?)", (product,))
-            conn.commit()
-        except sqlite3.IntegrityError:
-            pass
-        
+        # Also records place and product in their history tables
         today = datetime.now().strftime("%Y-%m-%d")
-        c.execute("INSERT INTO purchases (date, place, product, quantity, value) VALUES (?, ?, ?, ?, ?)",
-                  (today, place, product, qty, value))
-        conn.commit()
-        conn.close()
-        
+        self.add_button.disabled = True
+        done = self.app.metrics.timer('ui.add_purchase')
+        self.app.worker.run(self.db.add_purchase, today, place, product, qty, value,
+                            on_done=lambda purchase_id: self.on_purchase_added((place, product, qty, value), done),
+                            on_error=self.on_error)
+
+    def on_purchase_added(self, row, done=None):
+        self.add_button.disabled = False
+        if done is not None:
+            done(1)
+        for bar, name in ((self.place_suggestions, row[0]), (self.product_suggestions, row[1])):
+            if bar.index is not None:
+                bar.index.add(name)
         self.show_popup("Éxito", "Compra agregada")
-        self.load_daily_purchases()
+        self.append_purchase(row)
+        self.total_label.text = f"Total: {self.total}"
 
     def load_daily_purchases(self):
-        self.purchases_list.text = ""
         today = datetime.now().strftime("%Y-%m-%d")
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute("SELECT place, product, quantity, value FROM purchases WHERE date=?", (today,))
-        results = c.fetchall()
-        total = 0
-        text = ""
+        done = self.app.metrics.timer('ui.load_daily_purchases')
+        self.app.worker.run(self.db.daily_purchases, today,
+                            on_done=lambda results: self.show_daily_purchases(results, done))
+
+    def show_daily_purchases(self, results, done=None):
+        self.purchases_list.data = []
+        self.total = 0
         for row in results:
-            text += f"{row[0]} - {row[1]}: {row[2]} @ {row[3]}\n"
-            total += row[3]
-        text += f"Total: {total}"
-        self.purchases_list.text = text
-        conn.close()
+            self.append_purchase(row)
+        self.total_label.text = f"Total: {self.total}"
+        if done is not None:
+            done(len(results))
+
+    def append_purchase(self, row):
+        self.purchases_list.append(f"{row[0]} - {row[1]}: {row[2]} @ {row[3]}")
+        self.total = from_cents(to_cents(self.total) + to_cents(row[3]))
+
+    def on_error(self, error):
+        self.add_button.disabled = False
+        self.show_popup("Error", str(error))
 
     def show_popup(self, title, message):
         popup = Popup(title=title, content=Label(text=message), size_hint=(0.8, 0.4))
         popup.open()
 
     def back_to_menu(self, instance):
-        self.app.root.clear_widgets()
-        self.app.root.add_widget(MainMenuScreen(self.app))
+        self.app.show_screen('menu')
 
 # Balance Screen
 class BalanceScreen(BoxLayout):
@@ -355,7 +586,7 @@ class BalanceScreen(BoxLayout):
         self.orientation = 'vertical'
         self.padding = dp(20)
         self.spacing = dp(10)
-        self.db_path = app.db_path
+        self.db = app.db
         
         self.add_widget(Label(text="Balance e Informes", font_size=dp(24), color=(0, 0, 0, 1)))
         
@@ -375,24 +606,54 @@ class BalanceScreen(BoxLayout):
         self.end_date = TextInput(font_size=dp(16), multiline=False)
         self.add_widget(self.end_date)
         
-        generate_button = Button(text="Generar Informe", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
-        generate_button.bind(on_press=self.generate_report)
-        self.add_widget(generate_button)
+        self.generate_button = Button(text="Generar Informe", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
+        self.generate_button.bind(on_press=self.generate_report)
+        self.add_widget(self.generate_button)
         
         self.report_text = Label(text="", font_size=dp(14), color=(0, 0, 0, 1), text_size=(None, None), size_hint=(1, 1))
         self.add_widget(self.report_text)
         
-        pdf_button = Button(text="Exportar a PDF", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
-        pdf_button.bind(on_press=self.export_pdf)
-        self.add_widget(pdf_button)
+        # Trend: uses the dates above when both are filled in, else the report period
+        trend_row = BoxLayout(orientation='horizontal', spacing=dp(10), size_hint=(1, 0.2))
+        self.trend_granularity = Spinner(text="Día", values=list(reports.TREND_GRANULARITIES), font_size=dp(16))
+        trend_row.add_widget(self.trend_granularity)
+        self.trend_button = Button(text="Ver Tendencia", background_color=(1, 0.84, 0, 1))
+        self.trend_button.bind(on_press=self.generate_trend)
+        trend_row.add_widget(self.trend_button)
+        self.add_widget(trend_row)
+        
+        self.trend_chart = TrendChart(size_hint=(1, 1))
+        self.add_widget(self.trend_chart)
+        
+        self.pdf_button = Button(text="Exportar a PDF", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
+        self.pdf_button.bind(on_press=self.export_pdf)
+        self.add_widget(self.pdf_button)
+        
+        self.excel_button = Button(text="Exportar a Excel", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
+        self.excel_button.bind(on_press=self.export_excel)
+        self.add_widget(self.excel_button)
+        
+        self.detail_pdf_button = Button(text="Exportar Detalle a PDF", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
+        self.detail_pdf_button.bind(on_press=self.export_pdf_detailed)
+        self.add_widget(self.detail_pdf_button)
         
-        excel_button = Button(text="Exportar a Excel", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
-        excel_button.bind(on_press=self.export_excel)
-        self.add_widget(excel_button)
+        self.detail_excel_button = Button(text="Exportar Detalle a Excel", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
+        self.detail_excel_button.bind(on_press=self.export_excel_detailed)
+        self.add_widget(self.detail_excel_button)
+        
+        # Busy indicator for work running on the background worker
+        self.progress = ProgressBar(max=1, value=0, size_hint=(1, 0.1))
+        self.add_widget(self.progress)
+        
+        self.cancel_button = Button(text="Cancelar", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1), disabled=True)
+        self.cancel_button.bind(on_press=self.cancel_task)
+        self.add_widget(self.cancel_button)
         
         back_button = Button(text="Volver", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
         back_button.bind(on_press=self.back_to_menu)
         self.add_widget(back_button)
+        
+        self.task = None
 
     def generate_report(self, instance):
         report_type = self.report_type.text
@@ -403,27 +664,7 @@ class BalanceScreen(BoxLayout):
             self.show_popup("Error", "Seleccione tipo de informe")
             return
         
-        today = datetime.now()
-        if report_type == "Diario":
-            start = end = today.strftime("%Y-%m-%d")
-        elif report_type == "Semanal":
-            start = (today - timedelta(days=today.weekday())).strftime("%Y-%m-%d")
-            end = (today + timedelta(days=6 - today.weekday())).strftime("%Y-%m-%d")
-        elif report_type == "Quincenal":
-            if today.day <= 15:
-                start = today.replace(day=1).strftime("%Y-%m-%d")
-                end = today.replace(day=15).strftime("%Y-%m-%d")
-            else:
-                start = today.replace(day=16).strftime("%Y-%m-%d")
-                end = (today.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
-                end = end.strftime("%Y-%m-%d")
-        elif report_type == "Mensual":
-            start = today.replace(day=1).strftime("%Y-%m-%d")
-            end = (today.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
-            end = end.strftime("%Y-%m-%d")
-        elif report_type == "Anual":
-            start = today.replace(month=1, day=1).strftime("%Y-%m-%d")
-            end = today.replace(month=12, day=31).strftime("%Y-%m-%d")
+        start, end = reports.report_period(report_type, start, end)
         
         if start == "" or end == "":
             self.show_popup("Error", "Ingrese fechas válidas")
@@ -436,109 +677,482 @@ class BalanceScreen(BoxLayout):
             self.show_popup("Error", "Formato de fecha inválido")
             return
         
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        
-        # Sales
-        c.execute("SELECT payment_method, SUM(value) FROM sales WHERE date BETWEEN ? AND ? GROUP BY payment_method", (start, end))
-        sales = c.fetchall()
-        total_sales = sum([row[1] for row in sales])
-        
-        # Purchases
-        c.execute("SELECT SUM(value) FROM purchases WHERE date BETWEEN ? AND ?", (start, end))
-        total_purchases = c.fetchone()[0] or 0
-        
-        profits = total_sales - total_purchases
-        
-        text = f"Informe {report_type} ({start} a {end})\n\n"
-        text += "Ventas:\n"
-        for method, val in sales:
-            text += f"{method}: {val}\n"
-        text += f"Total Ventas: {total_sales}\n\n"
-        text += f"Compras Total: {total_purchases}\n\n"
-        text += f"Ganancias: {profits}\n"
-        self.report_text.text = text
-        
-        self.current_report = {
-            'type': report_type,
-            'start': start,
-            'end': end,
-            'sales': sales,
-            'total_sales': total_sales,
-            'total_purchases': total_purchases,
-            'profits': profits
-        }
-        
-        conn.close()
+        self.start_task(self.app.report_cache.get, report_type, start, end, on_done=self.show_report,
+                        name='ui.generate_report')
 
-    def export_pdf(self, instance):
-        if not hasattr(self, 'current_report'):
-            self.show_popup("Error", "Genere un informe primero")
+    def show_report(self, report):
+        self.finish_task()
+        self.report_text.text = reports.format_report(report)
+        self.current_report = report
+
+    def generate_trend(self, instance):
+        start, end = self.start_date.text, self.end_date.text
+        if not (start and end):
+            start, end = reports.report_period(self.report_type.text)
+        
+        try:
+            if datetime.strptime(start, "%Y-%m-%d") > datetime.strptime(end, "%Y-%m-%d"):
+                raise ValueError()
+        except ValueError:
+            self.show_popup("Error", "Formato de fecha inválido")
             return
         
-        report = self.current_report
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Arial", size=12)
-        pdf.cell(200, 10, txt=f"Informe {report['type']} ({report['start']} a {report['end']})", ln=1, align='C')
-        pdf.cell(200, 10, txt="Ventas:", ln=1)
-        for method, val in report['sales']:
-            pdf.cell(200, 10, txt=f"{method}: {val}", ln=1)
-        pdf.cell(200, 10, txt=f"Total Ventas: {report['total_sales']}", ln=1)
-        pdf.cell(200, 10, txt=f"Compras Total: {report['total_purchases']}", ln=1)
-        pdf.cell(200, 10, txt=f"Ganancias: {report['profits']}", ln=1)
-        
-        file_path = os.path.join('/sdcard/Documents', f"report_{report['type']}.pdf")
-        pdf.output(file_path)
-        self.show_popup("Éxito", f"Exportado a {file_path}")
+        granularity = reports.TREND_GRANULARITIES[self.trend_granularity.text]
+        self.start_task(reports.build_trend, self.db, start, end, granularity, on_done=self.show_trend,
+                        name='ui.generate_trend')
+
+    def show_trend(self, trend):
+        self.finish_task()
+        self.report_text.text = reports.format_trend(trend)
+        self.trend_chart.show(trend)
+
+    def export_pdf(self, instance):
+        self.run_export(reports.export_pdf, 'pdf')
 
     def export_excel(self, instance):
+        self.run_export(reports.export_excel, 'xlsx')
+
+    def export_pdf_detailed(self, instance):
+        self.run_export(reports.export_pdf_detailed, 'pdf', detailed=True)
+
+    def export_excel_detailed(self, instance):
+        self.run_export(reports.export_excel_detailed, 'xlsx', detailed=True)
+
+    def run_export(self, exporter, extension, detailed=False):
         if not hasattr(self, 'current_report'):
             self.show_popup("Error", "Genere un informe primero")
             return
         
         report = self.current_report
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Informe"
-        
-        ws['A1'] = f"Informe {report['type']} ({report['start']} a {report['end']})"
-        ws['A3'] = "Ventas"
-        row = 4
-        for method, val in report['sales']:
-            ws[f'A{row}'] = method
-            ws[f'B{row}'] = val
-            row += 1
-        ws[f'A{row}'] = "Total Ventas"
-        ws[f'B{row}'] = report['total_sales']
-        row += 2
-        ws[f'A{row}'] = "Compras Total"
-        ws[f'B{row}'] = report['total_purchases']
-        row += 1
-        ws[f'A{row}'] = "Ganancias"
-        ws[f'B{row}'] = report['profits']
-        
-        file_path = os.path.join('/sdcard/Documents', f"report_{report['type']}.xlsx")
-        wb.save(file_path)
+        file_path = reports.export_path(report, extension, suffix="_detalle" if detailed else "")
+        cache = self.app.report_cache
+
+        def export(progress=None):
+            # Goes through the cache so sales added since the report was shown
+            # are included; an unchanged period costs no query
+            fresh = cache.get(report['type'], report['start'], report['end'])
+            if detailed:
+                return exporter(self.db, fresh, file_path, progress=progress)
+            return exporter(fresh, file_path, progress=progress)
+
+        name = f"ui.export_{extension}{'_detailed' if detailed else ''}"
+        self.start_task(export, on_done=self.on_exported, on_progress=self.on_progress, name=name)
+
+    def start_task(self, fn, *args, on_done, on_progress=None, name=None):
+        # One report or export at a time; the buttons come back in finish_task.
+        # name times the task from the tap until on_done in the diagnostics.
+        for button in self.task_buttons():
+            button.disabled = True
+        self.cancel_button.disabled = on_progress is None
+        self.progress.value = 0
+
+        def run(*args, **kwargs):
+            # Buffered sales are committed first so the report includes them
+            self.app.sales.flush()
+            return fn(*args, **kwargs)
+
+        if name is not None:
+            done = self.app.metrics.timer(name)
+
+            def finished(result, on_done=on_done):
+                done()
+                on_done(result)
+            on_done = finished
+
+        self.task = self.app.worker.run(run, *args, on_done=on_done, on_error=self.on_task_error,
+                                        on_progress=on_progress)
+
+    def task_buttons(self):
+        return (self.generate_button, self.trend_button, self.pdf_button, self.excel_button,
+                self.detail_pdf_button, self.detail_excel_button)
+
+    def finish_task(self):
+        self.task = None
+        for button in self.task_buttons():
+            button.disabled = False
+        self.cancel_button.disabled = True
+        self.progress.value = 0
+
+    def cancel_task(self, instance):
+        if self.task is not None:
+            self.task.cancel()
+
+    def on_progress(self, fraction):
+        self.progress.value = fraction
+
+    def on_exported(self, file_path):
+        self.finish_task()
         self.show_popup("Éxito", f"Exportado a {file_path}")
 
+    def on_task_error(self, error):
+        self.finish_task()
+        if isinstance(error, TaskCancelled):
+            self.show_popup("Cancelado", "Operación cancelada")
+        else:
+            self.show_popup("Error", str(error))
+
+    def show_popup(self, title, message):
+        popup = Popup(title=title, content=Label(text=message), size_hint=(0.8, 0.4))
+        popup.open()
+
+    def back_to_menu(self, instance):
+        # A running export keeps going; this screen is cached and will show its result
+        self.app.show_screen('menu')
+
+# Purchase Analytics Screen
+class PurchaseAnalyticsScreen(BoxLayout):
+    # Spend by product and place, cheapest place per product and one
+    # product's unit cost over time, for a report period or custom dates
+    def __init__(self, app, **kwargs):
+        super().__init__(**kwargs)
+        self.app = app
+        self.orientation = 'vertical'
+        self.padding = dp(20)
+        self.spacing = dp(10)
+        self.db = app.db
+        
+        period_row = BoxLayout(orientation='horizontal', spacing=dp(10), size_hint=(1, 0.15))
+        self.report_type = Spinner(text="Mensual", values=["Diario", "Semanal", "Quincenal", "Mensual", "Anual"],
+                                   font_size=dp(16))
+        period_row.add_widget(self.report_type)
+        self.granularity = Spinner(text="Mes", values=list(reports.TREND_GRANULARITIES), font_size=dp(16))
+        period_row.add_widget(self.granularity)
+        self.add_widget(period_row)
+        
+        dates_row = BoxLayout(orientation='horizontal', spacing=dp(10), size_hint=(1, 0.15))
+        self.start_date = TextInput(font_size=dp(16), multiline=False, hint_text="Inicio YYYY-MM-DD")
+        dates_row.add_widget(self.start_date)
+        self.end_date = TextInput(font_size=dp(16), multiline=False, hint_text="Fin YYYY-MM-DD")
+        dates_row.add_widget(self.end_date)
+        self.add_widget(dates_row)
+        
+        self.product_input = TextInput(font_size=dp(16), multiline=False, hint_text="Producto (opcional)",
+                                       size_hint=(1, 0.15))
+        self.add_widget(self.product_input)
+        self.product_suggestions = SuggestionBar(self.product_input)
+        self.add_widget(self.product_suggestions)
+        
+        self.analyze_button = Button(text="Analizar", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
+        self.analyze_button.bind(on_press=self.analyze)
+        self.add_widget(self.analyze_button)
+        
+        self.results = TransactionList(size_hint=(1, 1))
+        self.add_widget(self.results)
+        
+        back_button = Button(text="Volver", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
+        back_button.bind(on_press=self.back_to_menu)
+        self.add_widget(back_button)
+
+    def refresh(self):
+        # Products bought since the last visit should be suggested too
+        self.app.worker.run(self.db.product_usage,
+                            on_done=lambda usage: setattr(self.product_suggestions, 'index', PrefixIndex(usage)))
+
+    def analyze(self, instance):
+        start, end = self.start_date.text, self.end_date.text
+        if not (start and end):
+            start, end = reports.report_period(self.report_type.text)
+        
+        try:
+            if datetime.strptime(start, "%Y-%m-%d") > datetime.strptime(end, "%Y-%m-%d"):
+                raise ValueError()
+        except ValueError:
+            self.show_popup("Error", "Formato de fecha inválido")
+            return
+        
+        granularity = reports.TREND_GRANULARITIES[self.granularity.text]
+        self.analyze_button.disabled = True
+        done = self.app.metrics.timer('ui.purchase_analytics')
+        self.app.worker.run(reports.build_purchase_analytics, self.db, start, end, self.product_input.text.strip(),
+                            granularity, on_done=lambda analytics: self.show_analytics(analytics, done),
+                            on_error=self.on_error)
+
+    def show_analytics(self, analytics, done=None):
+        self.analyze_button.disabled = False
+        self.results.data = []
+        for line in reports.format_purchase_analytics(analytics):
+            self.results.append(line)
+        if done is not None:
+            done(len(analytics['cheapest']))
+
+    def on_error(self, error):
+        self.analyze_button.disabled = False
+        self.show_popup("Error", str(error))
+
+    def show_popup(self, title, message):
+        popup = Popup(title=title, content=Label(text=message), size_hint=(0.8, 0.4))
+        popup.open()
+
+    def back_to_menu(self, instance):
+        self.app.show_screen('menu')
+
+# Backup Screen
+class BackupScreen(BoxLayout):
+    def __init__(self, app, **kwargs):
+        super().__init__(**kwargs)
+        self.app = app
+        self.orientation = 'vertical'
+        self.padding = dp(20)
+        self.spacing = dp(10)
+        self.snapshots = {}
+        
+        self.add_widget(Label(text="Copias de Seguridad", font_size=dp(24), color=(0, 0, 0, 1)))
+        self.status_label = Label(text="", font_size=dp(14), color=(0, 0, 0, 1))
+        self.add_widget(self.status_label)
+        
+        self.backup_button = Button(text="Crear Copia", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
+        self.backup_button.bind(on_press=self.create_backup)
+        self.add_widget(self.backup_button)
+        
+        self.snapshot = Spinner(text="", values=[], font_size=dp(16), size_hint=(1, 0.2))
+        self.add_widget(self.snapshot)
+        
+        self.restore_button = Button(text="Restaurar Copia", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
+        self.restore_button.bind(on_press=self.confirm_restore)
+        self.add_widget(self.restore_button)
+        
+        self.progress = ProgressBar(max=1, value=0, size_hint=(1, 0.1))
+        self.add_widget(self.progress)
+        
+        self.back_button = Button(text="Volver", size_hint=(1, 0.2), background_color=(1, 0.84, 0, 1))
+        self.back_button.bind(on_press=self.back_to_menu)
+        self.add_widget(self.back_button)
+
+    def refresh(self):
+        found = backup.snapshots(backup.backup_dir(self.app.db))
+        self.snapshots = {f"{created:%Y-%m-%d %H:%M:%S}": path for path, created in found}
+        self.snapshot.values = list(self.snapshots)
+        self.snapshot.text = self.snapshot.values[0] if found else ""
+        self.status_label.text = f"Última copia: {self.snapshot.text}" if found else "Sin copias"
+
+    def create_backup(self, instance):
+        self.set_busy(True)
+        self.app.worker.run(self.app.backup, on_done=self.on_backup_done, on_error=self.on_error,
+                            on_progress=self.on_progress)
+
+    def on_backup_done(self, path):
+        self.set_busy(False)
+        self.refresh()
+        self.show_popup("Éxito", "Copia creada")
+
+    def confirm_restore(self, instance):
+        if self.snapshot.text not in self.snapshots:
+            self.show_popup("Error", "Seleccione una copia")
+            return
+        content = BoxLayout(orientation='vertical', spacing=dp(10))
+        content.add_widget(Label(text=f"Se reemplazarán los datos actuales\npor la copia del {self.snapshot.text}"))
+        buttons = BoxLayout(orientation='horizontal', spacing=dp(10), size_hint=(1, 0.4))
+        popup = Popup(title="Restaurar", content=content, size_hint=(0.9, 0.5))
+        confirm = Button(text="Restaurar", background_color=(1, 0.84, 0, 1))
+        confirm.bind(on_press=lambda button: (popup.dismiss(), self.restore(self.snapshots[self.snapshot.text])))
+        cancel = Button(text="Cancelar", background_color=(1, 0.84, 0, 1))
+        cancel.bind(on_press=popup.dismiss)
+        buttons.add_widget(confirm)
+        buttons.add_widget(cancel)
+        content.add_widget(buttons)
+        popup.open()
+
+    def restore(self, path):
+        self.set_busy(True)
+        self.app.worker.run(self.app.restore, path, on_done=self.on_restored, on_error=self.on_error)
+
+    def on_restored(self, missing):
+        self.set_busy(False)
+        # Screens built before the restore hold the old day's lists and names
+        self.app.screens.forget(['sales', 'purchases', 'balance', 'analytics'])
+        message = "Copia restaurada"
+        if missing:
+            message += f"\nFaltan los archivos de {', '.join(map(str, missing))}"
+        self.show_popup("Éxito", message)
+
+    def set_busy(self, busy):
+        for button in (self.backup_button, self.restore_button, self.back_button):
+            button.disabled = busy
+        self.progress.value = 0
+
+    def on_progress(self, fraction):
+        self.progress.value = fraction
+
+    def on_error(self, error):
+        self.set_busy(False)
+        self.show_popup("Error", str(error))
+
     def show_popup(self, title, message):
         popup = Popup(title=title, content=Label(text=message), size_hint=(0.8, 0.4))
         popup.open()
 
     def back_to_menu(self, instance):
-        self.app.root.clear_widgets()
-        self.app.root.add_widget(MainMenuScreen(self.app))
+        self.app.show_screen('menu')
+
+# Diagnostics Screen
+class DiagnosticsScreen(BoxLayout):
+    # Hidden screen with the latency histograms and slow operations recorded
+    # since start; the JSON export is what a shop sends when it reports slowness
+    def __init__(self, app, **kwargs):
+        super().__init__(**kwargs)
+        self.app = app
+        self.orientation = 'vertical'
+        self.padding = dp(20)
+        self.spacing = dp(10)
+        
+        self.add_widget(Label(text="Diagnóstico", font_size=dp(24), color=(0, 0, 0, 1), size_hint=(1, 0.1)))
+        self.lines = TransactionList(size_hint=(1, 1))
+        self.add_widget(self.lines)
+        
+        buttons = BoxLayout(orientation='horizontal', spacing=dp(10), size_hint=(1, 0.15))
+        for text, handler in (("Actualizar", self.refresh), ("Exportar JSON", self.export),
+                              ("Reiniciar", self.reset)):
+            button = Button(text=text, background_color=(1, 0.84, 0, 1))
+            button.bind(on_press=handler)
+            buttons.add_widget(button)
+        self.add_widget(buttons)
+        
+        back_button = Button(text="Volver", size_hint=(1, 0.15), background_color=(1, 0.84, 0, 1))
+        back_button.bind(on_press=self.back_to_menu)
+        self.add_widget(back_button)
+
+    def refresh(self, *args):
+        self.lines.data = []
+        lines = format_snapshot(self.app.metrics.snapshot())
+        lines += ["", f"Inicio: {self.app.startup}",
+                  f"Ventas/s confirmadas: {self.app.sales.sales_per_second():.2f}",
+                  f"Diario SQLite: {self.app.db.journal_mode}"]
+        for line in lines:
+            self.lines.append(line)
+
+    def export(self, instance):
+        name = f"diagnostico_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        extra = {'startup': self.app.startup, 'journal_mode': self.app.db.journal_mode,
+                 'sales_per_second': round(self.app.sales.sales_per_second(), 3)}
+        self.app.worker.run(self.app.metrics.export, os.path.join(reports.EXPORT_DIR, name), extra,
+                            on_done=lambda path: self.show_popup("Éxito", f"Exportado a {path}"),
+                            on_error=lambda error: self.show_popup("Error", str(error)))
+
+    def reset(self, instance):
+        self.app.metrics.reset()
+        self.refresh()
+
+    def show_popup(self, title, message):
+        popup = Popup(title=title, content=Label(text=message), size_hint=(0.8, 0.4))
+        popup.open()
+
+    def back_to_menu(self, instance):
+        self.app.show_screen('menu')
+
+# Screen Manager
+class CachedScreenManager(ScreenManager):
+    # Each screen is built on its first visit and kept afterwards; switching
+    # back to it only calls its refresh() to reload the data it shows.
+    screen_classes = {
+        'login': LoginScreen,
+        'menu': MainMenuScreen,
+        'sales': SalesScreen,
+        'purchases': PurchasesScreen,
+        'balance': BalanceScreen,
+        'analytics': PurchaseAnalyticsScreen,
+        'backups': BackupScreen,
+        'diagnostics': DiagnosticsScreen,
+    }
+
+    def __init__(self, app, **kwargs):
+        super().__init__(transition=NoTransition(), **kwargs)
+        self.app = app
+        self.views = {}
+
+    def show(self, name):
+        if name not in self.views:
+            self.views[name] = self.screen_classes[name](self.app)
+            screen = Screen(name=name)
+            screen.add_widget(self.views[name])
+            self.add_widget(screen)
+        refresh = getattr(self.views[name], 'refresh', None)
+        if refresh is not None:
+            refresh()
+        self.current = name
+        return self.views[name]
+
+    def forget(self, names):
+        # Drops cached screens so their next visit builds them from scratch
+        for name in names:
+            if name in self.views and name != self.current:
+                del self.views[name]
+                self.remove_widget(self.get_screen(name))
 
 # Main App
 class BusinessApp(App):
     def __init__(self):
         super().__init__()
         self.username = None
-        self.db_path = init_db()
+        # Startup timings in seconds; the schema is initialized here and only here
+        self.startup = {'import': round(IMPORTED - STARTED, 3)}
+        started = time.perf_counter()
+        self.db = Database()
+        self.metrics = Metrics()
+        self.db.instrument(self.metrics)
+        self.startup['db_init'] = round(time.perf_counter() - started, 3)
+        self.db_path = self.db.db_path
+        self.worker = Worker()
+        self.sales = SaleBuffer(self.db)
+        self.report_cache = reports.ReportCache(self.db)
+        # Set by maintain(); the VACUUM waits for the app to be paused
+        self.vacuum_due = False
     
     def build(self):
-        return LoginScreen(self)
+        self.screens = CachedScreenManager(self)
+        self.show_screen('login')
+        return self.screens
+
+    def show_screen(self, name):
+        return self.screens.show(name)
+
+    def on_start(self):
+        from kivy.core.window import Window
+
+        Window.bind(on_flip=self.on_first_frame)
+
+    def on_first_frame(self, window):
+        window.unbind(on_flip=self.on_first_frame)
+        self.startup['first_frame'] = round(time.perf_counter() - STARTED, 3)
+        Logger.info(f"Startup: {self.startup}")
+        path = os.path.join(os.path.dirname(self.db_path), 'startup_times.jsonl')
+        self.worker.run(record_startup, path, self.startup)
+        # Archiving, ANALYZE and the daily backup, when due, once the first frame is up
+        self.worker.run(self.maintain, on_done=lambda done: Logger.info(f"Maintenance: {done}"),
+                        on_error=lambda error: Logger.warning(f"Maintenance failed: {error}"))
+
+    def maintain(self):
+        done = self.db.maintain()
+        self.vacuum_due = done['vacuum']
+        if backup.backup_due(self.db):
+            done['backup'] = self.backup()
+        return done
+
+    def backup(self, progress=None):
+        # Buffered sales are committed first so the snapshot has them
+        self.sales.flush()
+        return backup.backup(self.db, progress=progress)
+
+    def restore(self, path):
+        # Sales still in the buffer belong to the books being replaced
+        self.sales.flush()
+        missing = backup.restore(self.db, path)
+        self.sales.resync()
+        return missing
+
+    def on_pause(self):
+        # Android may kill a paused app; commit what the buffer holds
+        self.sales.flush()
+        # Nobody is at the counter: a good moment for a due VACUUM
+        if self.vacuum_due:
+            self.vacuum_due = False
+            self.worker.run(self.db.vacuum, on_done=lambda done: Logger.info("Maintenance: vacuumed"),
+                            on_error=lambda error: Logger.warning(f"Vacuum failed: {error}"))
+        return True
+
+    def on_stop(self):
+        self.worker.shutdown()
+        self.sales.close()
+        self.db.close()
 
 if __name__ == '__main__':
 
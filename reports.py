@@ -0,0 +1,492 @@
+# Report building and export, kept free of Kivy so it can run on a worker thread
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import os
+import threading
+from database import PURCHASE, from_cents
+
+EPOCH = datetime(1970, 1, 1).date()
+
+# fpdf and openpyxl are imported inside the export functions: they are
+# slow to load and only needed once the user actually exports.
+
+EXPORT_DIR = '/sdcard/Documents'
+
+SALES_HEADER = ["ID", "Fecha", "Modo de Pago", "Valor"]
+PURCHASES_HEADER = ["ID", "Fecha", "Lugar", "Producto", "Cantidad", "Valor"]
+
+
+def report_period(report_type, start="", end="", today=None):
+    # (start, end) as YYYY-MM-DD for a report type; other types keep the given dates
+    today = today or datetime.now()
+    if report_type == "Diario":
+        start = end = today.strftime("%Y-%m-%d")
+    elif report_type == "Semanal":
+        start = (today - timedelta(days=today.weekday())).strftime("%Y-%m-%d")
+        end = (today + timedelta(days=6 - today.weekday())).strftime("%Y-%m-%d")
+    elif report_type == "Quincenal":
+        if today.day <= 15:
+            start = today.replace(day=1).strftime("%Y-%m-%d")
+            end = today.replace(day=15).strftime("%Y-%m-%d")
+        else:
+            start = today.replace(day=16).strftime("%Y-%m-%d")
+            end = (today.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+            end = end.strftime("%Y-%m-%d")
+    elif report_type == "Mensual":
+        start = today.replace(day=1).strftime("%Y-%m-%d")
+        end = (today.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        end = end.strftime("%Y-%m-%d")
+    elif report_type == "Anual":
+        start = today.replace(month=1, day=1).strftime("%Y-%m-%d")
+        end = today.replace(month=12, day=31).strftime("%Y-%m-%d")
+    return start, end
+
+
+def build_report(db, report_type, start, end):
+    # Amounts are added up in integer cents and converted once, so the
+    # totals don't pick up float error (36.949999999999996)
+    # Sales
+    sales = db.sales_by_method(start, end, cents=True)
+    total_sales = sum([row[1] for row in sales])
+
+    # Purchases
+    total_purchases = db.total_purchases(start, end, cents=True)
+
+    profits = total_sales - total_purchases
+
+    return {
+        'type': report_type,
+        'start': start,
+        'end': end,
+        'sales': [(method, from_cents(cents)) for method, cents in sales],
+        'total_sales': from_cents(total_sales),
+        'total_purchases': from_cents(total_purchases),
+        'profits': from_cents(profits)
+    }
+
+
+class ReportCache:
+    # Bounded LRU of built reports keyed by (type, start, end). The whole
+    # cache is dropped as soon as the database's data version moves, so an
+    # unchanged period is served without touching the tables and a changed
+    # one is never served stale.
+    def __init__(self, db, max_entries=32):
+        self.db = db
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.version = None
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, report_type, start, end):
+        key = (report_type, start, end)
+        version = self.db.data_version()
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        report = build_report(self.db, report_type, start, end)
+        with self.lock:
+            self.misses += 1
+            if version == self.version:
+                self.entries[key] = report
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return report
+
+
+TREND_GRANULARITIES = {"Día": 'day', "Semana": 'week', "Mes": 'month'}
+
+
+def trend_bucket(day, granularity):
+    # Same bucket numbers as Database.trend_totals, computed from a date
+    if granularity == 'month':
+        return day.year * 12 + day.month - 1
+    number = (day - EPOCH).days
+    return number if granularity == 'day' else (number + 3) // 7
+
+
+def trend_buckets(start, end, granularity):
+    # [(bucket, label), ...] covering start..end, empty buckets included
+    buckets = []
+    day = start
+    while day <= end:
+        bucket = trend_bucket(day, granularity)
+        if not buckets or buckets[-1][0] != bucket:
+            label = day.strftime("%Y-%m") if granularity == 'month' else day.isoformat()
+            buckets.append((bucket, label))
+        day += timedelta(days=1)
+    return buckets
+
+
+def shift_months(day, months, month_end=False):
+    # day moved back by whole months, clamped to the shorter month; with
+    # month_end the last day of a month stays the last day
+    month = day.year * 12 + day.month - 1 - months
+    year, month = divmod(month, 12)
+    next_month = datetime(year + (month == 11), (month + 1) % 12 + 1, 1).date()
+    last = (next_month - timedelta(days=1)).day
+    if month_end and (day + timedelta(days=1)).day == 1:
+        return next_month - timedelta(days=1)
+    return day.replace(year=year, month=month + 1, day=min(day.day, last))
+
+
+def previous_period(start, end, granularity):
+    # The period start..end is compared with: as many whole months or weeks
+    # before it when the buckets are months or weeks, so both periods have
+    # the same buckets (October against September, not "the 31 days before"),
+    # and the same number of days before it otherwise
+    if granularity == 'month':
+        months = (end.year - start.year) * 12 + end.month - start.month + 1
+        return shift_months(start, months), shift_months(end, months, month_end=True)
+    if granularity == 'week':
+        weeks = trend_bucket(end, 'week') - trend_bucket(start, 'week') + 1
+        return start - timedelta(weeks=weeks), end - timedelta(weeks=weeks)
+    length = end - start + timedelta(days=1)
+    return start - length, start - timedelta(days=1)
+
+
+def build_trend(db, start, end, granularity):
+    # Series of sales per payment method, purchases and profit per bucket over
+    # start..end, next to the same series for the period before it (see
+    # previous_period). Both periods come from a single grouped query on the
+    # rollup; the rows are then scattered into dense per-bucket columns, added
+    # up in cents and converted at the end.
+    start_day = datetime.strptime(start, "%Y-%m-%d").date()
+    end_day = datetime.strptime(end, "%Y-%m-%d").date()
+    prev_start, prev_end = previous_period(start_day, end_day, granularity)
+
+    current = trend_buckets(start_day, end_day, granularity)
+    previous = trend_buckets(prev_start, prev_end, granularity)
+    # A week or month cut by the period boundary appears in both periods
+    position = {(True, bucket): (0, i) for i, (bucket, _) in enumerate(current)}
+    position.update({(False, bucket): (1, i) for i, (bucket, _) in enumerate(previous)})
+
+    sizes = (len(current), len(previous))
+    sales = [{}, {}]
+    purchases = [[0] * n for n in sizes]
+    for is_current, bucket, kind, method, total in db.trend_totals(prev_start.isoformat(), prev_end.isoformat(),
+                                                                        start, end, granularity, cents=True):
+        period, i = position[(is_current, bucket)]
+        if kind == PURCHASE:
+            purchases[period][i] += total
+        else:
+            sales[period].setdefault(method, [0] * sizes[period])[i] += total
+
+    def series(period):
+        total_sales = [sum(column) for column in zip(*sales[period].values())] or [0] * sizes[period]
+        profit = [s - p for s, p in zip(total_sales, purchases[period])]
+
+        def amounts(cents):
+            return [from_cents(value) for value in cents]
+        return {
+            'sales': {method: amounts(column) for method, column in sales[period].items()},
+            'total_sales': amounts(total_sales),
+            'purchases': amounts(purchases[period]),
+            'profit': amounts(profit),
+            'totals': {'sales': from_cents(sum(total_sales)), 'purchases': from_cents(sum(purchases[period])),
+                       'profit': from_cents(sum(profit))},
+        }
+
+    trend = series(0)
+    trend.update({
+        'granularity': granularity,
+        'start': start,
+        'end': end,
+        'labels': [label for _, label in current],
+        'previous': dict(series(1), start=prev_start.isoformat(), end=prev_end.isoformat()),
+    })
+    return trend
+
+
+def percent_change(now, before):
+    if not before:
+        return None
+    return (now - before) / abs(before) * 100
+
+
+def format_trend(trend):
+    previous = trend['previous']
+    text = f"Tendencia ({trend['start']} a {trend['end']})\n"
+    text += f"vs. ({previous['start']} a {previous['end']})\n\n"
+    for key, name in (('sales', "Ventas"), ('purchases', "Compras"), ('profit', "Ganancias")):
+        now, before = trend['totals'][key], previous['totals'][key]
+        change = percent_change(now, before)
+        text += f"{name}: {now} (antes {before}"
+        text += f", {change:+.1f}%)\n" if change is not None else ")\n"
+    return text
+
+
+def unit_cost(total, quantity):
+    return total / quantity if quantity else None
+
+
+def build_purchase_analytics(db, start, end, product="", granularity='month', limit=10):
+    # Top spend by product and by place, the cheapest place for each product
+    # and, when product is given, its unit cost (value / quantity) per bucket
+    analytics = {
+        'start': start,
+        'end': end,
+        'product': product,
+        'granularity': granularity,
+        'top_products': db.top_spend(start, end, 'product', limit),
+        'top_places': db.top_spend(start, end, 'place', limit),
+        'cheapest': db.cheapest_places(start, end),
+        'unit_costs': [],
+    }
+    if product:
+        start_day = datetime.strptime(start, "%Y-%m-%d").date()
+        end_day = datetime.strptime(end, "%Y-%m-%d").date()
+        costs = {bucket: unit_cost(total, quantity)
+                 for bucket, total, quantity in db.unit_costs(product, start, end, granularity)}
+        analytics['unit_costs'] = [(label, costs.get(bucket))
+                                   for bucket, label in trend_buckets(start_day, end_day, granularity)]
+    return analytics
+
+
+def format_purchase_analytics(analytics):
+    # One line per entry, for a scrolling list rather than a single label
+    lines = [f"Compras ({analytics['start']} a {analytics['end']})", ""]
+    if analytics['product']:
+        lines.append(f"Costo unitario de {analytics['product']}:")
+        costs = [(label, cost) for label, cost in analytics['unit_costs'] if cost is not None]
+        lines += [f"  {label}: {cost:.2f}" for label, cost in costs] or ["  Sin compras"]
+        lines.append("")
+    for key, title in (('top_products', "Mayor gasto por producto:"), ('top_places', "Mayor gasto por lugar:")):
+        lines.append(title)
+        for i, (name, total, quantity, count) in enumerate(analytics[key], start=1):
+            lines.append(f"  {i}. {name}: {total} ({count} compras)")
+        lines.append("")
+    lines.append("Lugar más barato por producto:")
+    for product, place, cost, places in analytics['cheapest']:
+        lines.append(f"  {product}: {place} a {cost:.2f}" + (f" (de {places} lugares)" if places > 1 else ""))
+    return lines
+
+
+def format_report(report):
+    text = f"Informe {report['type']} ({report['start']} a {report['end']})\n\n"
+    text += "Ventas:\n"
+    for method, val in report['sales']:
+        text += f"{method}: {val}\n"
+    text += f"Total Ventas: {report['total_sales']}\n\n"
+    text += f"Compras Total: {report['total_purchases']}\n\n"
+    text += f"Ganancias: {report['profits']}\n"
+    return text
+
+
+def export_path(report, extension, directory=None, suffix=""):
+    name = report['type'].replace(' ', '_')
+    return os.path.join(directory or EXPORT_DIR, f"report_{name}{suffix}.{extension}")
+
+
+def save_atomically(file_path, write):
+    # Writes to a temporary file first so a cancelled or failed export never
+    # leaves a truncated report behind
+    tmp_path = file_path + '.part'
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return file_path
+
+
+# progress, when given, is called with a fraction in [0, 1] and may raise to
+# cancel the export (see worker.Task.progress)
+def export_pdf(report, file_path, progress=None):
+    progress = progress or (lambda fraction: None)
+    progress(0)
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=12)
+    pdf.cell(200, 10, txt=f"Informe {report['type']} ({report['start']} a {report['end']})", ln=1, align='C')
+    pdf.cell(200, 10, txt="Ventas:", ln=1)
+    for method, val in report['sales']:
+        pdf.cell(200, 10, txt=f"{method}: {val}", ln=1)
+    pdf.cell(200, 10, txt=f"Total Ventas: {report['total_sales']}", ln=1)
+    pdf.cell(200, 10, txt=f"Compras Total: {report['total_purchases']}", ln=1)
+    pdf.cell(200, 10, txt=f"Ganancias: {report['profits']}", ln=1)
+    progress(0.5)
+
+    save_atomically(file_path, pdf.output)
+    progress(1)
+    return file_path
+
+
+def export_excel(report, file_path, progress=None):
+    progress = progress or (lambda fraction: None)
+    progress(0)
+    import openpyxl
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Informe"
+
+    ws['A1'] = f"Informe {report['type']} ({report['start']} a {report['end']})"
+    ws['A3'] = "Ventas"
+    row = 4
+    for method, val in report['sales']:
+        ws[f'A{row}'] = method
+        ws[f'B{row}'] = val
+        row += 1
+    ws[f'A{row}'] = "Total Ventas"
+    ws[f'B{row}'] = report['total_sales']
+    row += 2
+    ws[f'A{row}'] = "Compras Total"
+    ws[f'B{row}'] = report['total_purchases']
+    row += 1
+    ws[f'A{row}'] = "Ganancias"
+    ws[f'B{row}'] = report['profits']
+    progress(0.5)
+
+    save_atomically(file_path, wb.save)
+    progress(1)
+    return file_path
+
+
+def export_excel_detailed(db, report, file_path, progress=None):
+    # Every sale and purchase of the period. The write-only workbook flushes
+    # each appended row to disk, so memory stays flat however long the period.
+    progress = progress or (lambda fraction: None)
+    progress(0)
+    start, end = report['start'], report['end']
+    total_rows = max(db.count_sales(start, end) + db.count_purchases(start, end), 1)
+    done = 0
+
+    import openpyxl
+
+    wb = openpyxl.Workbook(write_only=True)
+    summary = wb.create_sheet("Resumen")
+    sales_ws = wb.create_sheet("Ventas")
+    purchases_ws = wb.create_sheet("Compras")
+
+    summary.append([f"Informe {report['type']} ({start} a {end})"])
+    summary.append([])
+    summary.append(["Ventas"])
+    for method, val in report['sales']:
+        summary.append([method, val])
+    summary.append(["Total Ventas", report['total_sales']])
+    summary.append([])
+    summary.append(["Compras Total", report['total_purchases']])
+    summary.append(["Ganancias", report['profits']])
+
+    for ws, header, rows in ((sales_ws, SALES_HEADER, db.iter_sales(start, end)),
+                             (purchases_ws, PURCHASES_HEADER, db.iter_purchases(start, end))):
+        ws.append(header)
+        try:
+            for row in rows:
+                ws.append(row)
+                done += 1
+                if done % 1000 == 0:
+                    progress(done / total_rows)
+        finally:
+            rows.close()
+
+    save_atomically(file_path, wb.save)
+    progress(1)
+    return file_path
+
+
+def pdf_table_header(pdf, title, columns):
+    pdf.set_font("helvetica", style='B', size=10)
+    pdf.cell(0, 8, title)
+    pdf.ln(8)
+    for name, width in columns:
+        pdf.cell(width, 7, name, border=1)
+    pdf.ln(7)
+    pdf.set_font("helvetica", size=9)
+
+
+def pdf_total_row(pdf, columns, label, total):
+    pdf.set_font("helvetica", style='B', size=9)
+    pdf.cell(sum(width for _, width in columns[:-1]), 6, label, border=1)
+    pdf.cell(columns[-1][1], 6, f"{total:.2f}", border=1, align='R')
+    pdf.ln(6)
+    pdf.set_font("helvetica", size=9)
+
+
+def pdf_ledger(pdf, title, columns, rows, on_row):
+    # One table per page run: when the next row would not fit above the two
+    # closing lines, close the page with its subtotal and repeat the header.
+    # Rows come from a cursor and are drawn as they arrive.
+    row_h = 6
+    pdf.add_page()
+    pdf_table_header(pdf, title, columns)
+    page_total = total = 0
+    for row in rows:
+        if pdf.get_y() + 3 * row_h > pdf.h - pdf.b_margin:
+            pdf_total_row(pdf, columns, "Subtotal página", page_total)
+            pdf.add_page()
+            pdf_table_header(pdf, f"{title} (cont.)", columns)
+            page_total = 0
+        value = row[-1]
+        for (name, width), cell in zip(columns[:-1], row[:-1]):
+            pdf.cell(width, row_h, str(cell)[:int(width / 1.8)], border=1)
+        pdf.cell(columns[-1][1], row_h, f"{value:.2f}", border=1, align='R')
+        pdf.ln(row_h)
+        page_total += value
+        total += value
+        on_row()
+    pdf_total_row(pdf, columns, "Subtotal página", page_total)
+    pdf_total_row(pdf, columns, f"Total {title}", total)
+    return total
+
+
+def export_pdf_detailed(db, report, file_path, progress=None):
+    # Paginated ledger of the period's sales and purchases, then a summary page
+    progress = progress or (lambda fraction: None)
+    progress(0)
+    start, end = report['start'], report['end']
+    total_rows = max(db.count_sales(start, end) + db.count_purchases(start, end), 1)
+    done = [0]
+
+    def on_row():
+        done[0] += 1
+        if done[0] % 500 == 0:
+            progress(done[0] / total_rows)
+
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    pdf.set_auto_page_break(False)
+
+    sales_columns = [("Fecha", 40), ("Modo de Pago", 80), ("Valor", 60)]
+    purchases_columns = [("Fecha", 30), ("Lugar", 50), ("Producto", 50), ("Cantidad", 25), ("Valor", 35)]
+    sales = db.iter_sales(start, end)
+    try:
+        pdf_ledger(pdf, "Ventas", sales_columns, ((d, m, v) for _, d, m, v in sales), on_row)
+    finally:
+        sales.close()
+    purchases = db.iter_purchases(start, end)
+    try:
+        pdf_ledger(pdf, "Compras", purchases_columns, ((d, pl, pr, q, v) for _, d, pl, pr, q, v in purchases), on_row)
+    finally:
+        purchases.close()
+
+    # Summary page
+    pdf.add_page()
+    pdf.set_font("helvetica", size=12)
+    pdf.cell(0, 10, f"Informe {report['type']} ({start} a {end})", align='C')
+    pdf.ln(10)
+    pdf.cell(0, 10, "Ventas:")
+    pdf.ln(10)
+    for method, val in report['sales']:
+        pdf.cell(0, 10, f"{method}: {val}")
+        pdf.ln(10)
+    for line in (f"Total Ventas: {report['total_sales']}",
+                 f"Compras Total: {report['total_purchases']}",
+                 f"Ganancias: {report['profits']}"):
+        pdf.cell(0, 10, line)
+        pdf.ln(10)
+    progress(0.95)
+
+    save_atomically(file_path, pdf.output)
+    progress(1)
+    return file_path
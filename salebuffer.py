@@ -0,0 +1,186 @@
+# Group commit for sales entered at the counter
+#
+# add() appends the sale to a small journal file next to business.db and
+# returns at once; a background thread commits the pending sales in one
+# transaction every FLUSH_INTERVAL seconds or MAX_PENDING sales. The journal
+# is written to the OS before add() returns, so a killed app loses nothing:
+# the next start replays it. Each journal entry carries a sequence number,
+# and the last one committed is stored with the rows (sale_journal), so an
+# entry is never inserted twice even if the app dies right after a commit.
+# An entry that cannot be stored is never journaled; one found in an old
+# journal is moved to the .rejected file next to it instead of blocking the
+# sales after it.
+import json
+import logging
+import math
+import os
+import threading
+import time
+from database import MAX_AMOUNT, PAYMENT_METHODS, to_day
+
+log = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 0.3  # seconds
+MAX_PENDING = 50
+
+
+def check_sale(date, value, payment_method):
+    # Returns value as a float if the sale converts to its stored form
+    # (days, cents, a known method), else raises ValueError
+    try:
+        to_day(date)
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Venta inválida: {date!r} {value!r}")
+    if not math.isfinite(value) or abs(value) >= MAX_AMOUNT:
+        raise ValueError(f"Valor inválido: {value!r}")
+    if payment_method not in PAYMENT_METHODS:
+        raise ValueError(f"Modo de pago inválido: {payment_method!r}")
+    return value
+
+
+class SaleBuffer:
+    def __init__(self, db, journal_path=None, flush_interval=FLUSH_INTERVAL, max_pending=MAX_PENDING):
+        self.db = db
+        self.journal_path = journal_path or db.db_path + '-sales.journal'
+        self.rejected_path = self.journal_path + '.rejected'
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.wake = threading.Condition(self.lock)
+        self.pending = []  # [(seq, date, value, payment_method), ...]
+        # Held while committing so flush() callers wait for an in-flight batch
+        self.flushing = threading.Lock()
+        self.closed = False
+        # Throughput counters for sales_per_second()
+        self.added = 0
+        self.committed = 0
+        self.started = time.perf_counter()
+
+        self.seq = self.db.journal_seq()
+        self.replay()
+        self.journal = open(self.journal_path, 'a', encoding='utf-8')
+        self.thread = threading.Thread(target=self.run, name='sale-buffer', daemon=True)
+        self.thread.start()
+
+    def replay(self):
+        # Commits journal entries left by a previous run that never reached
+        # the database, then starts a fresh journal
+        rows = []
+        rejected = []
+        last = self.seq
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        seq, date, value, method = entry = json.loads(line)
+                    except ValueError:
+                        break  # a line torn by the kill; nothing after it was acknowledged
+                    if seq > self.seq:
+                        try:
+                            rows.append((date, check_sale(date, value, method), method))
+                        except ValueError as e:
+                            rejected.append((entry, str(e)))
+                        last = seq
+        self.set_aside(rejected)
+        if rows:
+            self.db.add_sales_journaled(rows, last)
+        self.seq = last
+        with open(self.journal_path, 'w', encoding='utf-8'):
+            pass
+
+    def set_aside(self, rejected):
+        # Appends [(entry, reason), ...] to the .rejected file
+        if not rejected:
+            return
+        with open(self.rejected_path, 'a', encoding='utf-8') as f:
+            for entry, reason in rejected:
+                log.warning(f"SaleBuffer: set aside {entry}: {reason}")
+                f.write(json.dumps([*entry, reason], ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add(self, date, value, payment_method):
+        # Validated sale in; durable against an app kill when this returns.
+        # Raises ValueError, before journaling anything, for a sale that
+        # could not be stored.
+        value = check_sale(date, value, payment_method)
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("SaleBuffer is closed")
+            self.seq += 1
+            self.journal.write(json.dumps([self.seq, date, value, payment_method]) + "\n")
+            self.journal.flush()
+            self.pending.append((self.seq, date, value, payment_method))
+            self.added += 1
+            if len(self.pending) >= self.max_pending:
+                self.wake.notify()
+            return self.seq
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.closed and len(self.pending) < self.max_pending:
+                    self.wake.wait(self.flush_interval)
+                if self.closed:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                # The sales stay pending and in the journal; retried next round
+                log.error(f"SaleBuffer: flush failed, {len(self.pending)} sales pending: {e!r}")
+
+    def flush(self):
+        # Commits everything added so far; returns the number of sales written.
+        # Readers call this first so the day's list and the reports see them.
+        with self.flushing:
+            with self.lock:
+                batch = self.pending
+                self.pending = []
+            if not batch:
+                return 0
+            try:
+                self.db.add_sales_journaled([row[1:] for row in batch], batch[-1][0])
+            except Exception:
+                # Entries that can never be stored are moved aside so they
+                # do not fail every later flush; the rest are retried
+                keep, rejected = [], []
+                for row in batch:
+                    try:
+                        check_sale(*row[1:])
+                        keep.append(row)
+                    except ValueError as e:
+                        rejected.append((list(row), str(e)))
+                self.set_aside(rejected)
+                with self.lock:
+                    self.pending[:0] = keep
+                raise
+            with self.lock:
+                self.committed += len(batch)
+                # Once everything journaled is committed the journal can start over
+                if not self.pending:
+                    self.journal.truncate(0)
+                    self.journal.seek(0)
+            return len(batch)
+
+    def resync(self):
+        # After a restore: the snapshot's last committed journal entry may be
+        # ahead of ours, and new entries must come after it or a replay would
+        # skip them
+        with self.lock:
+            self.seq = max(self.seq, self.db.journal_seq())
+
+    def sales_per_second(self):
+        # Committed sales per second since the buffer was created
+        elapsed = time.perf_counter() - self.started
+        return self.committed / elapsed if elapsed > 0 else 0.0
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.wake.notify()
+        self.thread.join()
+        try:
+            self.flush()
+        finally:
+            self.journal.close()
@@ -0,0 +1,43 @@
+# In-memory prefix index for as-you-type suggestions
+import bisect
+import heapq
+import unicodedata
+
+
+def normalize(text):
+    # Case- and accent-insensitive key, so "cafe" finds "Café"
+    text = unicodedata.normalize('NFKD', text.strip().casefold())
+    return ''.join(ch for ch in text if not unicodedata.combining(ch))
+
+
+class PrefixIndex:
+    # Keys are kept sorted so a prefix maps to one contiguous slice found with
+    # bisect; each name carries its use count and the sequence number of its
+    # last use, which together rank the matches.
+    def __init__(self, usage=()):
+        # usage: [(name, count, last_used), ...]
+        self.stats = {}
+        self.seq = 0
+        for name, count, last_used in usage:
+            self.stats[name] = [count, last_used]
+            self.seq = max(self.seq, last_used)
+        self.keys = sorted((normalize(name), name) for name in self.stats)
+
+    def add(self, name):
+        # Records one more use of name, inserting it if it is new
+        self.seq += 1
+        if name in self.stats:
+            self.stats[name][0] += 1
+            self.stats[name][1] = self.seq
+        else:
+            self.stats[name] = [1, self.seq]
+            bisect.insort(self.keys, (normalize(name), name))
+
+    def suggest(self, prefix, limit=3):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        start = bisect.bisect_left(self.keys, (prefix,))
+        end = bisect.bisect_left(self.keys, (prefix + '\uffff',), start)
+        matches = (name for key, name in self.keys[start:end])
+        return heapq.nlargest(limit, matches, key=lambda name: self.stats[name])
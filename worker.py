@@ -0,0 +1,72 @@
+# Runs repository calls and exports off the Kivy main thread
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from kivy.clock import Clock
+from kivy.logger import Logger
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class Task:
+    def __init__(self, on_progress=None):
+        self.cancel_event = threading.Event()
+        self.on_progress = on_progress
+        self.future = None
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def progress(self, fraction):
+        # Called from the worker thread. Raising here is how a running job
+        # notices that cancel() was requested.
+        if self.cancelled:
+            raise TaskCancelled()
+        if self.on_progress is not None:
+            Clock.schedule_once(lambda dt: self.on_progress(fraction))
+
+
+class Worker:
+    # Two threads so a long export does not hold up the quick queries behind it
+    def __init__(self, max_workers=2):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='worker')
+
+    def run(self, fn, *args, on_done=None, on_error=None, on_progress=None, **kwargs):
+        # on_done(result) and on_error(exception) are called on the main thread.
+        # When on_progress is given, fn also receives progress=task.progress.
+        task = Task(on_progress)
+        if on_progress is not None:
+            kwargs['progress'] = task.progress
+
+        def job():
+            if task.cancelled:
+                raise TaskCancelled()
+            return fn(*args, **kwargs)
+
+        def finished(future):
+            if future.cancelled():
+                error = TaskCancelled()
+            else:
+                error = future.exception()
+            if error is None:
+                result = future.result()
+                if on_done is not None:
+                    Clock.schedule_once(lambda dt: on_done(result))
+            elif on_error is not None:
+                Clock.schedule_once(lambda dt: on_error(error))
+            elif not isinstance(error, TaskCancelled):
+                Logger.error(f"Worker: {getattr(fn, '__name__', fn)} failed: {error!r}")
+
+        task.future = self.executor.submit(job)
+        task.future.add_done_callback(finished)
+        return task
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)